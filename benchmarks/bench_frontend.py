@@ -0,0 +1,64 @@
+"""
+Compares the speed of the regex-based Lexer, and of the Parser using it, with the original character-at-a-time
+ReferenceLexer, on a large outline made of copies of the example outline. Run from the repository root:
+
+    python -m benchmarks.bench_frontend [copies]
+"""
+import sys
+import time
+
+from proofchecker import Lexer, Parser
+from benchmarks.reference_lexer import ReferenceLexer, ReferenceParser
+
+def best_time(f, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def tokenize(lexerClass, text):
+    lexer = lexerClass(text)
+    tokens = []
+    while True:
+        token = lexer.next_token()
+        tokens.append((token, lexer.tokenLoc()))
+        if token == 'EOF':
+            return tokens
+
+def parse(parserClass, text):
+    parser = parserClass(text)
+    result = []
+    while parser.tokenType != 'EOF':
+        if parser.tokenType == 'EOL':
+            parser.eat()
+        elif parser.tokenType == '#':
+            result.append(parser.parseLaw())
+        else:
+            result.append(parser.parseProof())
+    return result
+
+def main(args):
+    copies = int(args[1]) if len(args) > 1 else 50
+    with open('gevolgtrekkingen_uit_voorbeeldsilhouetten.py') as f:
+        text = f.read() * copies
+    print("Outline of %d lines, %d characters" % (text.count('\n'), len(text)))
+
+    if tokenize(Lexer, text) != tokenize(ReferenceLexer, text) or parse(Parser, text) != parse(ReferenceParser, text):
+        print("The lexers disagree!")
+        return 1
+
+    for label, f, g in [
+        ('tokenize', lambda: tokenize(ReferenceLexer, text), lambda: tokenize(Lexer, text)),
+        ('parse', lambda: parse(ReferenceParser, text), lambda: parse(Parser, text))
+    ]:
+        reference = best_time(f)
+        current = best_time(g)
+        print("%-10s reference %8.1f ms   current %8.1f ms   speedup %.1fx" % (label, reference * 1000, current * 1000, reference / current))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,68 @@
+"""
+Compares the speed of the polynomial engine of proofchecker (sorted tuples of interned monomials) with the original
+dict-based add_polys and scale_poly, on polynomials in n variables, and times the normal form of a large linear
+expression and the expansion of a product. Run from the repository root:
+
+    python -m benchmarks.bench_poly [n ...]
+"""
+import random
+import sys
+
+import proofchecker
+from proofchecker import mk_term
+from benchmarks import reference_poly
+from benchmarks.bench_frontend import best_time
+
+def random_sum(n, rng):
+    """Returns a balanced sum and difference of constants and about 2n terms x_i, with n distinct variables."""
+    terms = [mk_term('int', rng.randint(-5, 5))]
+    for i in rng.sample(range(2 * n), n):
+        terms.extend([mk_term('var', 'x%d' % i)] * rng.randint(1, 3))
+    rng.shuffle(terms)
+    while len(terms) > 1:
+        terms = [mk_term('+' if rng.random() < 0.7 else '-', *terms[i:i + 2]) if i + 1 < len(terms) else terms[i] for i in range(0, len(terms), 2)]
+    return terms[0]
+
+def normal_form_without_cache(e):
+    proofchecker.clear_monomial_table()
+    return proofchecker.compute_poly(e)
+
+def main(args):
+    sizes = [int(arg) for arg in args[1:]] or [10, 100, 1000]
+    rng = random.Random(0)
+    for n in sizes:
+        e1 = random_sum(n, rng)
+        e2 = random_sum(n, rng)
+        old1, old2 = reference_poly.get_poly(e1), reference_poly.get_poly(e2)
+        new1, new2 = proofchecker.get_poly(e1), proofchecker.get_poly(e2)
+        if len(proofchecker.add_polys(new1, new2)) != len(reference_poly.add_polys(old1, old2)):
+            print("The engines disagree!")
+            return 1
+        repeat = max(1, 100000 // n)
+
+        def repeated(f):
+            def run():
+                for _ in range(repeat):
+                    f()
+            return run
+
+        for label, f, g in [
+            ('add', repeated(lambda: reference_poly.add_polys(old1, old2)), repeated(lambda: proofchecker.add_polys(new1, new2))),
+            ('scale', repeated(lambda: reference_poly.scale_poly(-1, old1)), repeated(lambda: proofchecker.scale_poly(-1, new1))),
+            ('normalize', lambda: reference_poly.get_poly(e1), lambda: normal_form_without_cache(e1))
+        ]:
+            reference = best_time(f)
+            current = best_time(g)
+            print("n=%-5d %-10s reference %9.3f ms   current %9.3f ms   speedup %.1fx" % (n, label, reference * 1000, current * 1000, reference / current))
+
+    # The reference engine cannot do this: it treats products as opaque
+    factors = [mk_term('+', mk_term('var', 'x%d' % i), mk_term('int', i)) for i in range(8)]
+    product = factors[0]
+    for factor in factors[1:]:
+        product = mk_term('*', product, factor)
+    print("expanding a product of 8 binomials: %.3f ms (%d monomials)" % (best_time(lambda: normal_form_without_cache(product)) * 1000, len(proofchecker.compute_poly(product))))
+    proofchecker.clear_monomial_table()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
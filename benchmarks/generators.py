@@ -0,0 +1,32 @@
+"""
+Generators of families of proof outlines, indexed by a size n, that each stress one hot path of the checker. Each
+generator returns the text of a valid outline.
+"""
+
+def long_conjunction(n):
+    """A proof whose assertions are conjunctions of n comparisons; the second one reorders the first."""
+    conjuncts = ['x%d == %d' % (i, i) for i in range(n)]
+    return 'assert %s\nassert %s\n' % (' and '.join(conjuncts), ' and '.join(reversed(conjuncts)))
+
+def deep_sum(n, prefix='x'):
+    """The expression x0 + x1 + ... + x(n-1), which parses as a chain of n - 1 nested additions."""
+    return ' + '.join('%s%d' % (prefix, i) for i in range(n))
+
+def deep_plus_chain(n):
+    """A proof that rearranges a sum of n variables by Z."""
+    return 'assert 0 <= %s\nassert 1 <= 1 + %s # Z op 1\n' % (deep_sum(n), ' + '.join('x%d' % i for i in reversed(range(n))))
+
+def repeated_subterms(n):
+    """A proof that rewrites every other one of n occurrences of f(x) into y."""
+    target = ' + '.join(['f(x)'] * n)
+    conjunct = ' + '.join('y' if i % 2 == 0 else 'f(x)' for i in range(n))
+    return 'assert f(x) == y and 0 <= %s\nassert 0 <= %s # Herschrijven met 1 in 2\n' % (target, conjunct)
+
+def law_library(n):
+    """n law declarations, followed by a proof that applies the last one."""
+    laws = ''.join('# Wet L%d: x <= y ==> f%d(x) <= f%d(y)\n' % (i, i, i) for i in range(n))
+    return laws + 'assert a <= b\nassert f%d(a) <= f%d(b) # L%d op 1\n' % (n - 1, n - 1, n - 1)
+
+def z_chain(n):
+    """A proof of n + 1 assertions, each following by Z op 1 from the previous one."""
+    return 'assert 0 <= i\n' + ''.join('assert %d <= i + %d # Z op 1\n' % (k, k) for k in range(1, n + 1))
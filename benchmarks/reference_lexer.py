@@ -0,0 +1,100 @@
+"""
+The original character-at-a-time Lexer, kept as a reference for benchmarking and cross-checking the regex-based Lexer
+of proofchecker.
+"""
+from proofchecker import ParseError, Parser
+
+def is_alpha(c):
+    return 'A' <= c <= 'Z' or 'a' <= c <= 'z' or c == '_'
+
+def is_digit(c):
+    return '0' <= c <= '9'
+
+operators = {'!=', '==', '<=', '<', '+', '-', '#', '(', ')', ',', '==>', ':', '[', ']', '*'}
+operatorPrefixes = set()
+for operator in operators:
+    for i in range(1,len(operator) + 1):
+        operatorPrefixes.add(operator[:i])
+
+keywords = ['assert', 'and', 'True', 'Herschrijven', 'met', 'in', 'Z', 'op', 'Wet', 'not', 'en', 'if', 'else', 'of']
+
+class ReferenceLexer:
+    def __init__(self, text, line=0):
+        self.text = text
+        self.pos = -1
+        self.line = line
+        self.startOfLine = 0
+        self.eat()
+
+    def get_token_value(self):
+        return self.text[self.tokenStart:self.pos]
+
+    def eat(self):
+        if 0 <= self.pos and self.text[self.pos] == '\n':
+            self.line += 1
+            self.startOfLine = self.pos + 1
+        self.pos += 1
+        if self.pos == len(self.text):
+            self.c = '\0'
+        else:
+            self.c = self.text[self.pos]
+
+    def tokenLoc(self):
+        return ((self.line, self.tokenStart - self.startOfLine), (self.line, self.pos - self.startOfLine))
+
+    def error(self, msg):
+        raise ParseError(((self.line, self.pos - self.startOfLine), (self.line, self.pos - self.startOfLine + 1)), msg)
+
+    def next_token(self):
+        while self.c == ' ':
+            if self.pos == self.startOfLine:
+                self.error("Indentation is not supported")
+            self.eat()
+        self.tokenStart = self.pos
+        if self.c == '\0':
+            return 'EOF'
+        if self.c == '\n':
+            self.eat()
+            self.startOfLine = self.pos
+            return 'EOL'
+        if is_alpha(self.c):
+            self.eat()
+            while is_alpha(self.c) or is_digit(self.c):
+                self.eat()
+            if self.get_token_value() in keywords:
+                return self.get_token_value()
+            return 'identifier'
+        if is_digit(self.c):
+            self.eat()
+            while is_digit(self.c):
+                self.eat()
+            return 'number'
+        operatorLength = 0
+        operatorPrefixLength = 1
+        while True:
+            operatorPrefix = self.text[self.tokenStart:self.tokenStart + operatorPrefixLength]
+            if not operatorPrefix in operatorPrefixes:
+                break
+            if operatorPrefix in operators:
+                operatorLength = operatorPrefixLength
+            operatorPrefixLength += 1
+        if operatorLength == 0:
+            self.error("Bad token")
+        for i in range(operatorLength):
+            self.eat()
+        return self.get_token_value()
+
+class ReferenceParser(Parser):
+    """A Parser that uses the ReferenceLexer, and the original way of advancing to the next token."""
+    tokenLoc = None
+
+    def __init__(self, text, line=0):
+        self.lexer = ReferenceLexer(text, line)
+        self.tokenType = self.lexer.next_token()
+        self.tokenLoc = self.lexer.tokenLoc()
+
+    def eat(self):
+        value = self.lexer.get_token_value()
+        self.tokenType = self.lexer.next_token()
+        self.tokenLoc = self.lexer.tokenLoc()
+        return value
@@ -0,0 +1,47 @@
+"""
+The original dict-based linear normal form of proofchecker (monomials are tuples of whole subterms, and * is not
+expanded), kept as a reference for benchmarking the polynomial engine.
+"""
+def add_polys(poly1, poly2):
+    poly1Keys = set(poly1.keys())
+    poly2Keys = set(poly2.keys())
+    result = {}
+    for key in poly1Keys - poly2Keys:
+        result[key] = poly1[key]
+    for key in poly2Keys - poly1Keys:
+        result[key] = poly2[key]
+    for key in poly1Keys & poly2Keys:
+        value = poly1[key] + poly2[key]
+        if value == 0:
+            pass
+        else:
+            result[key] = value
+    return result
+
+def scale_poly(coef, poly):
+    if coef == 0:
+        return {}
+    else:
+        result = {}
+        for key in poly.keys():
+            result[key] = coef * poly[key]
+        return result
+
+def get_poly(e):
+    if e[0] == 'var':
+        return {(e,): 1}
+    elif e[0] == 'int':
+        if e[1] == 0:
+            return {}
+        else:
+            return {(): e[1]}
+    elif e[0] == '+':
+        poly1 = get_poly(e[1])
+        poly2 = get_poly(e[2])
+        return add_polys(poly1, poly2)
+    elif e[0] == '-':
+        poly1 = get_poly(e[1])
+        poly2 = get_poly(e[2])
+        return add_polys(poly1, scale_poly(-1, poly2))
+    else:
+        return {(e,): 1}
@@ -0,0 +1,198 @@
+"""
+Times the hot paths of the checker on the outline families of benchmarks.generators, at growing sizes, and fits the
+growth exponent k of time ~ size ** k by least squares on a log-log scale. Run from the repository root:
+
+    python -m benchmarks.run [--quick] [--tolerance FACTOR] [--update-baseline] [names ...]
+
+A benchmark fails if its fitted exponent exceeds its allowed maximum (about 1 for the paths that should be linear),
+or if its time at the largest size measured, relative to a fixed calibration workload so that it can be compared
+across machines, exceeds the one stored for that size in benchmarks/baseline.json by more than the tolerance factor.
+The baseline has a time for each size, so that --quick is checked against it too. Exits with status 1 if any
+benchmark fails.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import proofchecker
+from proofchecker import Checker, Parser, mk_term, get_conjuncts, rewrites_to, try_match, follows_in_Z_from
+from benchmarks import generators
+
+baselinePath = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+def measure(f, minTime=0.05, repeat=5):
+    """Returns the best time per call of f, calling it often enough that each measurement takes at least minTime."""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            f()
+        elapsed = time.perf_counter() - start
+        if elapsed >= minTime:
+            break
+        calls *= 2
+    best = elapsed / calls
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            f()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+def calibrate():
+    """Returns the time taken by a fixed pure-Python workload, the unit of the times stored in the baseline."""
+    def workload():
+        d = {}
+        for i in range(10000):
+            d[(i, i % 7)] = d.get((i - 1, (i - 1) % 7), 0) + 1
+    return measure(workload)
+
+def fit_exponent(sizes, times):
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(t) for t in times]
+    meanX = sum(xs) / len(xs)
+    meanY = sum(ys) / len(ys)
+    return sum((x - meanX) * (y - meanY) for x, y in zip(xs, ys)) / sum((x - meanX) ** 2 for x in xs)
+
+def get_step(text):
+    """Returns the antecedent, the consequent and the justification of the first step of the outline in text."""
+    proof = Parser(text).parseProof()
+    return get_conjuncts(proof[0][1]), get_conjuncts(proof[1][1]), proof[1][2]
+
+def rewrite_setup(text):
+    """Returns the bindings, the equation, the target and the conjunct of the Herschrijven step of the outline."""
+    antecedent, consequent, _ = get_step(text)
+    equation = antecedent[0]
+    # As in check_entailment, the variables of an antecedent conjunct stand for themselves
+    bindings = dict((x, mk_term('var', x)) for x in equation.freeVars)
+    return bindings, equation, antecedent[1], consequent[0]
+
+def bench_parse(family):
+    def setup(n):
+        text = family(n)
+        return lambda: Parser(text).parseProof()
+    return setup
+
+def bench_rewrites_to(n):
+    bindings, equation, target, conjunct = rewrite_setup(generators.repeated_subterms(n))
+    return lambda: rewrites_to(target, conjunct, bindings, equation[1], equation[2])
+
+def bench_match_law_library(n):
+    checker = Checker()
+    checker.add_laws_from_text(''.join(line + '\n' for line in generators.law_library(n).splitlines() if line.startswith('#')))
+    conjunct = Parser('f%d(a) <= f%d(b)\n' % (n - 1, n - 1)).parseExpression()
+    conclusions = [conclusion for premisses, conclusion in checker.laws.values()]
+
+    def f():
+        for conclusion in conclusions:
+            try_match({}, conclusion, conjunct, [])
+    return f
+
+def bench_compiled_match_law_library(n):
+    checker = Checker()
+    checker.add_laws_from_text(''.join(line + '\n' for line in generators.law_library(n).splitlines() if line.startswith('#')))
+    conjunct = Parser('f%d(a) <= f%d(b)\n' % (n - 1, n - 1)).parseExpression()
+    matchers = [proofchecker.get_compiled_matcher(conclusion) for premisses, conclusion in checker.laws.values()]
+
+    def f():
+        for matcher in matchers:
+            matcher(conjunct, {}, [])
+    return f
+
+def bench_match_deep_sum(n):
+    pattern = Parser(generators.deep_sum(n, 'p') + '\n').parseExpression()
+    term = Parser(generators.deep_sum(n) + '\n').parseExpression()
+    return lambda: try_match({}, pattern, term, [])
+
+def bench_follows_in_Z(n):
+    antecedent, consequent, _ = get_step(generators.deep_plus_chain(n))
+
+    def f():
+        # Start from empty tables and caches, as for a new step
+        proofchecker.clear_monomial_table()
+        follows_in_Z_from(consequent[0], antecedent[0])
+    return f
+
+def bench_check_text(family):
+    def setup(n):
+        text = family(n)
+
+        def f():
+            # Otherwise all steps but those of the first call are found in the step verdict cache
+            proofchecker.stepVerdictCache.clear()
+            Checker().check_text(text)
+        return f
+    return setup
+
+linear = 1.4
+
+# (name, sizes, setup, maximum exponent or None if the growth is only reported)
+benchmarks = [
+    ('parseProof/long_conjunction', [100, 200, 400, 800, 1600], bench_parse(generators.long_conjunction), linear),
+    ('parseProof/deep_plus_chain', [100, 200, 400, 800, 1600], bench_parse(generators.deep_plus_chain), linear),
+    ('rewrites_to/repeated_subterms', [50, 100, 200, 400], bench_rewrites_to, linear),
+    ('match/law_library', [50, 100, 200, 400], bench_match_law_library, linear),
+    ('compiled_match/law_library', [50, 100, 200, 400], bench_compiled_match_law_library, linear),
+    ('match/deep_sum', [50, 100, 200, 400], bench_match_deep_sum, linear),
+    ('follows_in_Z_from/deep_plus_chain', [50, 100, 200, 400], bench_follows_in_Z, linear),
+    ('check_text/z_chain', [50, 100, 200, 400], bench_check_text(generators.z_chain), linear),
+    ('check_text/law_library', [50, 100, 200, 400], bench_check_text(generators.law_library), linear),
+    ('check_text/long_conjunction', [100, 200, 400, 800, 1600], bench_check_text(generators.long_conjunction), linear),
+]
+
+def main(args):
+    argParser = argparse.ArgumentParser(description="Runs the scaling benchmarks of the proof checker.")
+    argParser.add_argument('names', nargs='*', help="run only the benchmarks whose name starts with one of these")
+    argParser.add_argument('--quick', action='store_true', help="skip the largest size of each benchmark")
+    argParser.add_argument('--tolerance', type=float, default=2.0, help="allowed slowdown factor w.r.t. the baseline")
+    argParser.add_argument('--update-baseline', action='store_true', help="store the measured times as the baseline")
+    options = argParser.parse_args(args[1:])
+
+    baseline = {}
+    if os.path.exists(baselinePath):
+        with open(baselinePath) as f:
+            baseline = json.load(f)
+    unit = calibrate()
+    failures = []
+    for name, sizes, setup, maxExponent in benchmarks:
+        if options.names and not any(name.startswith(prefix) for prefix in options.names):
+            continue
+        if options.quick:
+            sizes = sizes[:-1]
+        times = [measure(setup(size)) for size in sizes]
+        exponent = fit_exponent(sizes, times)
+        verdicts = []
+        if maxExponent is not None and exponent > maxExponent:
+            verdicts.append("super-linear: exponent %.2f > %.2f" % (exponent, maxExponent))
+        note = ''
+        if options.update_baseline:
+            for size, t in zip(sizes, times):
+                baseline['%s@%d' % (name, size)] = t / unit
+        else:
+            # Compare at the largest size measured that has a baseline, e.g. the one but largest with --quick
+            compared = [('%s@%d' % (name, size), t / unit) for size, t in zip(sizes, times) if '%s@%d' % (name, size) in baseline]
+            if compared == []:
+                note = '  (no baseline at these sizes)'
+            else:
+                key, relative = compared[-1]
+                if relative > baseline[key] * options.tolerance:
+                    verdicts.append("regression: %.1fx the baseline" % (relative / baseline[key]))
+        print("%-36s %s  exponent %.2f  %s%s" % (
+            name, '  '.join('%d: %.3f ms' % (size, t * 1000) for size, t in zip(sizes, times)), exponent,
+            'FAIL (%s)' % '; '.join(verdicts) if verdicts else 'ok', note))
+        if verdicts:
+            failures.append(name)
+    if options.update_baseline:
+        with open(baselinePath, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if failures:
+        print("%d benchmark(s) failed: %s" % (len(failures), ', '.join(failures)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
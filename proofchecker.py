@@ -1,13 +1,45 @@
+import argparse
+import collections
+import contextlib
+import hashlib
+import http.server
+import itertools
+import json
 import math
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import struct
 import sys
-import tkinter
-from fractions import Fraction
-from tkinter import filedialog, scrolledtext, messagebox
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 class LocError(Exception):
+    @classmethod
+    def at(cls, loc, msg):
+        e = cls.__new__(cls)
+        Exception.__init__(e, msg)
+        e.loc = loc
+        return e
+
+    def __reduce__(self):
+        return type(self).at, (self.loc, self.args[0])
+
+    @property
+    def message(self):
+        """The message as text; args[0] may also be a Diagnostic, which is rendered only here."""
+        return str(self.args[0])
+
     def __str__(self):
         (startLine, startCol), (endLine, endCol) = self.loc
-        return "%s:%s: %s" % (startLine + 1, startCol, self.args[0])
+        return "%s:%s: %s" % (startLine + 1, startCol, self.message)
 
 class ParseError(LocError):
     def __init__(self, loc, msg):
@@ -21,12 +53,18 @@ def is_digit(c):
     return '0' <= c <= '9'
 
 operators = {'!=', '==', '<=', '<', '+', '-', '#', '(', ')', ',', '==>', ':', '[', ']', '*'}
-operatorPrefixes = set()
-for operator in operators:
-    for i in range(1,len(operator) + 1):
-        operatorPrefixes.add(operator[:i])
 
-keywords = ['assert', 'and', 'True', 'Herschrijven', 'met', 'in', 'Z', 'op', 'Wet', 'not', 'en', 'if', 'else', 'of']
+keywords = {'assert', 'and', 'True', 'Herschrijven', 'met', 'in', 'Z', 'op', 'Wet', 'not', 'en', 'if', 'else', 'of'}
+
+# Splits a text into tokens, runs of spaces and single characters that start no token, so the matches cover the text.
+tokenPattern = re.compile('|'.join(
+    [r'[A-Za-z_][A-Za-z_0-9]*', r'[0-9]+', r' +'] +
+    [re.escape(operator) for operator in sorted(operators, key=len, reverse=True) if len(operator) > 1] +
+    [r'[\s\S]']
+))
+identifierStartChars = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_')
+digitChars = frozenset('0123456789')
+tokenTypes = dict([(operator, operator) for operator in operators] + [(keyword, keyword) for keyword in keywords] + [('\n', 'EOL')])
 
 binaryOperators = {'==>', 'and', '==', '<=', '<', '+', '-', '!=', '*'}
 symmetricBinaryOperators = {'and', '==', '+', '*'}
@@ -34,27 +72,107 @@ symmetricBinaryOperators = {'and', '==', '+', '*'}
 unaryOperators = {'not'}
 nullaryOperators = {'True'}
 
+class Term(tuple):
+    """
+    A hash-consed term. Terms are built with mk_term only, so that structurally equal terms are (normally) the same
+    object and equality is an identity check. Each term caches its hash, its size, its free variables and its head
+    symbol (the function name for calls, the node kind otherwise), and, once it has been used as a pattern, its
+    compiled matcher (see get_compiled_matcher) or the arguments of its associative and commutative operator.
+    """
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is Term and self._hash != other._hash:
+            return False
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return mk_term, tuple(self)
+
+emptyVars = frozenset()
+termTable = {}
+
+def mk_term(*node):
+    term = termTable.get(node)
+    if term is not None:
+        return term
+    term = Term(node)
+    term._hash = tuple.__hash__(term)
+    kind = node[0]
+    if kind == 'var':
+        term.freeVars = frozenset((node[1],))
+        term.size = 1
+        term.head = kind
+        return termTable.setdefault(term, term)
+    if kind == 'call':
+        children = node[2]
+        term.head = node[1]
+    else:
+        children = node[1:] if kind != 'int' else ()
+        term.head = kind
+    freeVars = emptyVars
+    size = 1
+    for child in children:
+        size += child.size
+        if freeVars is emptyVars:
+            freeVars = child.freeVars
+        elif not child.freeVars <= freeVars:
+            freeVars = freeVars | child.freeVars
+    term.freeVars = freeVars
+    term.size = size
+    return termTable.setdefault(term, term)
+
+def clear_term_table():
+    """Forgets all interned terms. Terms built earlier remain valid; they are then compared structurally."""
+    termTable.clear()
+
+# The number of checks in progress in this process, on any thread. The intern tables are trimmed only when no other
+# check is in progress.
+activeChecks = 0
+activeChecksLock = threading.Lock()
+
+@contextlib.contextmanager
+def check_in_progress():
+    global activeChecks
+    with activeChecksLock:
+        activeChecks += 1
+    try:
+        yield
+    finally:
+        with activeChecksLock:
+            activeChecks -= 1
+
+def trim_intern_tables(maxEntries):
+    """
+    Called during a check: clears the tables of interned terms and monomials, and the step verdict cache, if they hold
+    more than maxEntries entries and no other check is in progress.
+    """
+    with activeChecksLock:
+        if activeChecks <= 1 and len(termTable) + get_monomial_table_size() > maxEntries:
+            clear_term_table()
+            clear_monomial_table()
+            stepVerdictCache.clear()
+
 class Lexer:
-    def __init__(self, text):
+    def __init__(self, text, line=0):
         self.text = text
-        self.pos = -1
-        self.line = 0
+        self.tokens = tokenPattern.findall(text)
+        self.index = 0
+        self.pos = 0
+        self.tokenStart = 0
+        self.value = ''
+        self.line = line
         self.startOfLine = 0
-        self.eat()
 
     def get_token_value(self):
         return self.text[self.tokenStart:self.pos]
 
-    def eat(self):
-        if 0 <= self.pos and self.text[self.pos] == '\n':
-            self.line += 1
-            self.startOfLine = self.pos + 1
-        self.pos += 1
-        if self.pos == len(self.text):
-            self.c = '\0'
-        else:
-            self.c = self.text[self.pos]
-
     def tokenLoc(self):
         return ((self.line, self.tokenStart - self.startOfLine), (self.line, self.pos - self.startOfLine))
 
@@ -62,57 +180,54 @@ class Lexer:
         raise ParseError(((self.line, self.pos - self.startOfLine), (self.line, self.pos - self.startOfLine + 1)), msg)
 
     def next_token(self):
-        while self.c == ' ':
-            if self.pos == self.startOfLine:
-                self.error("Indentation is not supported")
-            self.eat()
+        tokens = self.tokens
+        while self.index < len(tokens):
+            value = tokens[self.index]
+            self.tokenStart = start = self.pos
+            tokenType = tokenTypes.get(value)
+            if tokenType is None:
+                c = value[0]
+                if c in identifierStartChars:
+                    tokenType = 'identifier'
+                elif c in digitChars:
+                    tokenType = 'number'
+                elif c == ' ':
+                    if start == self.startOfLine:
+                        self.error("Indentation is not supported")
+                    self.index += 1
+                    self.pos = start + len(value)
+                    continue
+                elif c == '\0':
+                    return 'EOF'
+                else:
+                    self.error("Bad token")
+            self.index += 1
+            self.pos = start + len(value)
+            self.value = value
+            if tokenType == 'EOL':
+                self.line += 1
+                self.startOfLine = self.pos
+            return tokenType
         self.tokenStart = self.pos
-        if self.c == '\0':
-            return 'EOF'
-        if self.c == '\n':
-            self.eat()
-            self.startOfLine = self.pos
-            return 'EOL'
-        if is_alpha(self.c):
-            self.eat()
-            while is_alpha(self.c) or is_digit(self.c):
-                self.eat()
-            if self.get_token_value() in keywords:
-                return self.get_token_value()
-            return 'identifier'
-        if is_digit(self.c):
-            self.eat()
-            while is_digit(self.c):
-                self.eat()
-            return 'number'
-        operatorLength = 0
-        operatorPrefixLength = 1
-        while True:
-            operatorPrefix = self.text[self.tokenStart:self.tokenStart + operatorPrefixLength]
-            if not operatorPrefix in operatorPrefixes:
-                break
-            if operatorPrefix in operators:
-                operatorLength = operatorPrefixLength
-            operatorPrefixLength += 1
-        if operatorLength == 0:
-            self.error("Bad token")
-        for i in range(operatorLength):
-            self.eat()
-        return self.get_token_value()
+        self.value = ''
+        return 'EOF'
 
 class Parser:
-    def __init__(self, text):
-        self.lexer = Lexer(text)
+    def __init__(self, text, line=0):
+        """Parses text, which starts at the given line of the file (for error locations)."""
+        self.lexer = Lexer(text, line)
         self.tokenType = self.lexer.next_token()
-        self.tokenLoc = self.lexer.tokenLoc()
+
+    @property
+    def tokenLoc(self):
+        return self.lexer.tokenLoc()
 
     def error(self, msg):
         raise ParseError(self.tokenLoc, msg)
 
     def eat(self):
-        value = self.lexer.get_token_value()
+        value = self.lexer.value
         self.tokenType = self.lexer.next_token()
-        self.tokenLoc = self.lexer.tokenLoc()
         return value
 
     def parsePrimaryExpression(self):
@@ -127,14 +242,14 @@ class Parser:
                         self.eat()
                         args.append(self.parseExpression())
                 self.expect(')')
-                return 'call', x, tuple(args)
-            return 'var', x
+                return mk_term('call', x, tuple(args))
+            return mk_term('var', x)
         elif self.tokenType == 'number':
             v = int(self.eat())
-            return 'int', v
+            return mk_term('int', v)
         elif self.tokenType == 'True':
             self.eat()
-            return 'True',
+            return mk_term('True')
         elif self.tokenType == '(':
             self.eat()
             e = self.parseExpression()
@@ -143,7 +258,7 @@ class Parser:
         elif self.tokenType == 'not':
             self.eat()
             e = self.parseComparison()
-            return ('not', e)
+            return mk_term('not', e)
         else:
             self.error("Expression expected")
 
@@ -154,24 +269,24 @@ class Parser:
             if self.tokenType == ':':
                 self.eat()
                 if self.tokenType == ']':
-                    end = ('call', 'len', (e,))
+                    end = mk_term('call', 'len', (e,))
                 else:
                     end = self.parseExpression()
                 self.expect(']')
-                e = ('call', '#slice', (e, ('int', 0), end))
+                e = mk_term('call', '#slice', (e, mk_term('int', 0), end))
             else:
                 index = self.parseExpression()
                 if self.tokenType == ':':
                     self.eat()
                     if self.tokenType == ']':
-                        end = ('call', 'len', (e,))
+                        end = mk_term('call', 'len', (e,))
                     else:
                         end = self.parseExpression()
                     self.expect(']')
-                    e = ('call', '#slice', (e, index, end))
+                    e = mk_term('call', '#slice', (e, index, end))
                 else:
                     self.expect(']')
-                    e = ('call', '#subscript', (e, index))
+                    e = mk_term('call', '#subscript', (e, index))
         return e
 
     def parseMultiplication(self):
@@ -180,7 +295,7 @@ class Parser:
             if self.tokenType == '*':
                 self.eat()
                 e2 = self.parseSuffixExpression()
-                e = ('*', e, e2)
+                e = mk_term('*', e, e2)
             else:
                 return e
 
@@ -190,11 +305,11 @@ class Parser:
             if self.tokenType == '+':
                 self.eat()
                 e2 = self.parseMultiplication()
-                e = ('+', e, e2)
+                e = mk_term('+', e, e2)
             elif self.tokenType == '-':
                 self.eat()
                 e2 = self.parseMultiplication()
-                e = ('-', e, e2)
+                e = mk_term('-', e, e2)
             else:
                 return e
 
@@ -204,13 +319,13 @@ class Parser:
             operator = self.tokenType
             self.eat()
             e2 = self.parseAddition()
-            result = (operator, e, e2)
+            result = mk_term(operator, e, e2)
             e = e2
             while self.tokenType in ['==', '<=', '<', '!=']:
                 operator = self.tokenType
                 self.eat()
                 e2 = self.parseAddition()
-                result = ('and', result, (operator, e, e2))
+                result = mk_term('and', result, mk_term(operator, e, e2))
                 e = e2
             return result
         else:
@@ -222,11 +337,14 @@ class Parser:
         return self.eat()
 
     def parseConjunction(self):
-        e = self.parseComparison()
+        conjuncts = [self.parseComparison()]
         while self.tokenType == 'and':
             self.eat()
-            e2 = self.parseConjunction()
-            e = ('and', e, e2)
+            conjuncts.append(self.parseComparison())
+        # and associates to the right
+        e = conjuncts.pop()
+        while conjuncts != []:
+            e = mk_term('and', conjuncts.pop(), e)
         return e
 
     def parseIfThenElse(self):
@@ -236,7 +354,7 @@ class Parser:
             cond = self.parseExpression()
             self.expect('else')
             elseBranch = self.parseIfThenElse()
-            return ('call', '#ifthenelse', (cond, e, elseBranch))
+            return mk_term('call', '#ifthenelse', (cond, e, elseBranch))
         else:
             return e
 
@@ -244,7 +362,7 @@ class Parser:
         e = self.parseIfThenElse()
         if self.tokenType == '==>':
             self.eat()
-            return ('==>', e, self.parseIfThenElse())
+            return mk_term('==>', e, self.parseIfThenElse())
         return e
 
     def parseExpression(self):
@@ -324,138 +442,794 @@ class Parser:
         self.expect('EOL')
         return (name, rule)
 
-def get_rewrites_for_tuple(es, bindings, lhs, rhs):
-    if es == ():
-        return [es]
-    else:
-        rewrites = []
-        for e in get_rewrites(es[0], bindings, lhs, rhs):
-            for es0 in get_rewrites_for_tuple(es[1:], bindings, lhs, rhs):
-                rewrites.append((e,) + es0)
-        return rewrites
-
-def get_rewrites(e, bindings, lhs, rhs):
-    rewrites = [e] # e itself is a rewrite of itself
-    try:
-        bindings1 = dict(bindings)
-        match(bindings1, lhs, e)
-        rewrites.append(subst(rhs, bindings1))
-    except MatchFailure:
-        pass
-    try:
-        bindings1 = dict(bindings)
-        match(bindings1, rhs, e)
-        rewrites.append(subst(lhs, bindings1))
-    except MatchFailure:
-        pass
-    if e[0] in binaryOperators:
-        for e1 in get_rewrites(e[1], bindings, lhs, rhs):
-            for e2 in get_rewrites(e[2], bindings, lhs, rhs):
-                rewrites.append((e[0], e1, e2))
-    elif e[0] in unaryOperators:
-        for e1 in get_rewrites(e[1], bindings, lhs, rhs):
-            rewrites.append((e[0], e1))
-    elif e[0] == 'call':
-        for args in get_rewrites_for_tuple(e[2], bindings, lhs, rhs):
-            rewrites.append(('call', e[1], args))
-    return rewrites
+    def parseOutlineLine(self):
+        """Parses a single line of a proof outline: a blank line (None), a law, a law library reference or an assert."""
+        if self.tokenType in ('EOL', 'EOF'):
+            return None
+        elif self.tokenType == '#':
+            match = lawLibraryPattern.match(self.lexer.text, self.lexer.tokenStart)
+            if match is not None:
+                return ('library', match.group(1))
+            return ('law',) + self.parseLaw()
+        elif self.tokenType == 'assert':
+            return ('assert', self.parseProofLine())
+        else:
+            raise ProofError.at(self.tokenLoc, "Need at least one assert")
+
+# The binding strength of the binary operators, as in the parser: an operand with a lower level is parenthesized
+termLevels = {'==>': 0, 'and': 2, '==': 3, '<=': 3, '<': 3, '!=': 3, '+': 4, '-': 4, '*': 5}
+
+def get_term_parts(e):
+    """
+    Returns the level of e, as in termLevels (1 for conditional expressions, 3 for not, 6 for primary expressions),
+    and the parts of its source text: strings and (subterm, minimum level) pairs.
+    """
+    kind = e[0]
+    if kind == 'var':
+        return 6, [e[1]]
+    elif kind == 'int':
+        return 6, [str(e[1])]
+    elif kind == 'True':
+        return 6, ['True']
+    elif kind == 'not':
+        return 3, ['not ', (e[1], 3)]
+    elif kind in binaryOperators:
+        level = termLevels[kind]
+        if kind == '==>':
+            return level, [(e[1], 1), ' ==> ', (e[2], 1)]
+        elif kind == 'and':
+            return level, [(e[1], 3), ' and ', (e[2], 2)]
+        elif level == 3:
+            return level, [(e[1], 4), ' %s ' % kind, (e[2], 4)]
+        return level, [(e[1], level), ' %s ' % kind, (e[2], level + 1)]
+    assert kind == 'call'
+    name, args = e[1], e[2]
+    if name == '#subscript' and len(args) == 2:
+        return 6, [(args[0], 6), '[', (args[1], 0), ']']
+    elif name == '#slice' and len(args) == 3:
+        parts = [(args[0], 6), '[']
+        if args[1] != ('int', 0):
+            parts.append((args[1], 0))
+        parts.append(':')
+        if args[2] != ('call', 'len', (args[0],)):
+            parts.append((args[2], 0))
+        parts.append(']')
+        return 6, parts
+    elif name == '#ifthenelse' and len(args) == 3:
+        return 1, [(args[1], 2), ' if ', (args[0], 0), ' else ', (args[2], 1)]
+    parts = [name, '(']
+    for i, arg in enumerate(args):
+        if i > 0:
+            parts.append(', ')
+        parts.append((arg, 0))
+    parts.append(')')
+    return 6, parts
+
+def render_term(e, maxDepth=None, maxLength=None):
+    """
+    Returns the source text of e, with the subterms at depth maxDepth, if given, replaced by '...', or None if the
+    text is longer than maxLength.
+    """
+    pieces = []
+    length = 0
+    stack = [(e, 0, 0)]
+    while stack != []:
+        item, minLevel, depth = stack.pop()
+        if type(item) is str:
+            text = item
+        elif maxDepth is not None and depth >= maxDepth:
+            text = '...'
+        else:
+            level, parts = get_term_parts(item)
+            if level < minLevel:
+                parts = ['('] + parts + [')']
+            for part in reversed(parts):
+                stack.append((part, 0, 0) if type(part) is str else (part[0], part[1], depth + 1))
+            continue
+        pieces.append(text)
+        length += len(text)
+        if maxLength is not None and length > maxLength:
+            return None
+    return ''.join(pieces)
+
+def term_to_text(e, maxLength=None):
+    """
+    Returns e as source text, as it would be written in an outline, but with parentheses only where needed. If the
+    text would be longer than maxLength, the deepest subterms are replaced by '...', as few as needed to fit.
+    """
+    text = render_term(e, None, maxLength)
+    if text is not None:
+        return text
+    # The text only grows with the depth; search the greatest depth at which it fits, doubling the depth first
+    text = '...'
+    low, high = 1, 1
+    while True:
+        shorter = render_term(e, high, maxLength)
+        if shorter is None:
+            break
+        text = shorter
+        low, high = high + 1, high * 2
+    while low < high:
+        maxDepth = (low + high) // 2
+        shorter = render_term(e, maxDepth, maxLength)
+        if shorter is None:
+            high = maxDepth
+        else:
+            text = shorter
+            low = maxDepth + 1
+    return text
+
+class Diagnostic:
+    """
+    A message about terms, rendered only when it is converted to a string. The %s placeholders of format are filled in
+    with the arguments: terms as source text (see term_to_text), Diagnostics, dicts of bindings or other values. Each
+    argument takes at most maxArgLength characters, so that a message stays small whatever the size of the terms.
+    """
+    maxArgLength = 200
+
+    def __init__(self, format, *args):
+        self.format = format
+        self.args = args
+        self.text = None
+
+    def render_arg(self, arg):
+        if type(arg) is Term:
+            return term_to_text(arg, self.maxArgLength)
+        elif isinstance(arg, Diagnostic):
+            return str(arg)
+        elif isinstance(arg, dict):
+            text = '{%s}' % ', '.join('%s: %s' % (x, self.render_arg(t)) for x, t in sorted(arg.items()))
+        else:
+            text = str(arg)
+        return text if len(text) <= self.maxArgLength else text[:self.maxArgLength - 3] + '...'
+
+    def __str__(self):
+        if self.text is None:
+            self.text = self.format % tuple(map(self.render_arg, self.args))
+        return self.text
+
+    def __repr__(self):
+        return 'Diagnostic(%r)' % str(self)
+
+def split_lines(text):
+    """Splits text into lines, keeping the line terminators. Only '\\n' ends a line, as for the Lexer."""
+    lines = text.split('\n')
+    result = [line + '\n' for line in lines[:-1]]
+    if lines[-1] != '':
+        result.append(lines[-1])
+    return result
+
+def is_assert_line(lineText):
+    return lineText.startswith('assert') and not (len(lineText) > 6 and (is_alpha(lineText[6]) or is_digit(lineText[6])))
+
+def split_outline(text):
+    """
+    Splits an outline into proof blocks, i.e. maximal runs of assert lines, and the other lines. Returns a list of
+    ('block', lineNo, lines) and ('line', lineNo, lineText) triples, where lineNo is the number of the first line.
+    """
+    segments = []
+    for lineNo, lineText in enumerate(split_lines(text)):
+        if not is_assert_line(lineText):
+            segments.append(('line', lineNo, lineText))
+        elif segments != [] and segments[-1][0] == 'block':
+            segments[-1][2].append(lineText)
+        else:
+            segments.append(('block', lineNo, [lineText]))
+    return segments
+
+def rewrites_to(target, conjunct, bindings, lhs, rhs, memo=None):
+    """
+    Returns whether conjunct can be obtained from target by replacing some occurrences of instances of lhs by the
+    corresponding instances of rhs and/or some occurrences of instances of rhs by the corresponding instances of lhs,
+    matching and comparing subterms modulo associativity and commutativity.
+
+    Instead of enumerating all rewrites of target, target and conjunct are walked together and the verdict for each
+    pair of subterms is computed only once. Calls with the same bindings, lhs and rhs may share memo.
+    """
+    if memo is None:
+        memo = {}
+    siteBindings = dict(bindings)
+    trail = []
+
+    def rewrites_at(pattern, replacement, t, c):
+        if statsCollectors:
+            count('rewrite_sites')
+        # Pattern variables of the replacement not bound by the pattern may be instantiated arbitrarily
+        result = try_match_all(siteBindings, [(pattern, t), (replacement, c)], trail)
+        undo_bindings(siteBindings, trail, 0)
+        return result
+
+    def walk_ac(ts, cs):
+        """
+        Returns whether the terms cs are rewrites of the terms ts in some order. The terms that occur on both sides are
+        left out, and the remaining ones, grouped by their AC normal form, are matched by augmenting paths.
+        """
+        if len(ts) != len(cs):
+            return False
+        tCounts = collections.Counter(map(get_ac_normal_form, ts))
+        cCounts = collections.Counter(map(get_ac_normal_form, cs))
+        common = tCounts & cCounts
+        tGroups = list((tCounts - common).items())
+        cGroups = list((cCounts - common).items())
+        capacities = [n for _, n in cGroups]
+        # The number of terms of each group of ts matched to each group of cs
+        flow = collections.Counter()
+
+        def augment(i, seen):
+            for j, (c, _) in enumerate(cGroups):
+                if j not in seen and walk(tGroups[i][0], c):
+                    seen.add(j)
+                    if capacities[j] > 0:
+                        capacities[j] -= 1
+                        flow[i, j] += 1
+                        return True
+                    for k in range(len(tGroups)):
+                        if flow[k, j] > 0 and augment(k, seen):
+                            flow[k, j] -= 1
+                            flow[i, j] += 1
+                            return True
+            return False
+
+        return all(augment(i, set()) for i, (_, n) in enumerate(tGroups) for _ in range(n))
+
+    def walk(t, c):
+        if ac_equal(t, c):
+            return True
+        key = (id(t), id(c))
+        if key in memo:
+            return memo[key]
+        if rewrites_at(lhs, rhs, t, c) or rewrites_at(rhs, lhs, t, c):
+            result = True
+        elif t[0] != c[0]:
+            result = False
+        elif t[0] in symmetricBinaryOperators:
+            result = walk(t[1], c[1]) and walk(t[2], c[2]) or walk(t[1], c[2]) and walk(t[2], c[1])
+            if not result and t[0] in acOperators:
+                # The rewritten arguments may also be grouped or ordered differently
+                result = walk_ac(get_ac_args(t), get_ac_args(c))
+        elif t[0] in binaryOperators:
+            result = walk(t[1], c[1]) and walk(t[2], c[2])
+        elif t[0] in unaryOperators:
+            result = walk(t[1], c[1])
+        elif t[0] == 'call':
+            result = t[1] == c[1] and len(t[2]) == len(c[2]) and all(map(walk, t[2], c[2]))
+        else:
+            result = False
+        memo[key] = result
+        return result
+
+    return walk(target, conjunct)
+
+def find_rewrite_mismatch(target, conjunct, bindings, lhs, rhs):
+    """
+    Given that conjunct is not a rewrite of target (see rewrites_to), returns the subterms t of target and c of
+    conjunct at the innermost position where this shows: following the single pair of children that is not a rewrite,
+    as long as there is exactly one.
+    """
+    memo = {}
+    t, c = target, conjunct
+    while True:
+        if t[0] != c[0]:
+            return t, c
+        if t[0] in binaryOperators or t[0] in unaryOperators:
+            pairings = [list(zip(get_children(t), get_children(c)))]
+            if t[0] in symmetricBinaryOperators:
+                pairings.append([(t[1], c[2]), (t[2], c[1])])
+            if t[0] in acOperators:
+                # Also pair up the arguments left after leaving out the ones that occur on both sides
+                ts = get_ac_args(t)
+                cs = get_ac_args(c)
+                for arg in list(ts):
+                    j = next((j for j, c1 in enumerate(cs) if ac_equal(arg, c1)), None)
+                    if j is not None:
+                        ts.remove(arg)
+                        del cs[j]
+                if len(ts) == len(cs):
+                    pairings.append(list(zip(ts, cs)))
+        elif t[0] == 'call' and t[1] == c[1] and len(t[2]) == len(c[2]):
+            pairings = [list(zip(t[2], c[2]))]
+        else:
+            return t, c
+        failures = min(([(t1, c1) for t1, c1 in pairing if not rewrites_to(t1, c1, bindings, lhs, rhs, memo)] for pairing in pairings), key=len)
+        if len(failures) != 1:
+            return t, c
+        t, c = failures[0]
+
+def get_rewrite_candidate(t, bindings, lhs, rhs):
+    """Returns the rewrite of t at its root, in either direction, or None if neither lhs nor rhs matches t."""
+    for pattern, replacement in ((lhs, rhs), (rhs, lhs)):
+        patternBindings = dict(bindings)
+        if try_match(patternBindings, pattern, t, []) and all(x in patternBindings for x in replacement.freeVars):
+            return subst(replacement, patternBindings)
+    return None
+
+class RewriteFailure(Diagnostic):
+    """
+    Explains why conjunct is not a rewrite of target: by the innermost position where they differ (see
+    find_rewrite_mismatch) and the rewrite at that position, if any. Both are computed only when rendered.
+    """
+    def __init__(self, target, conjunct, bindings, lhs, rhs):
+        Diagnostic.__init__(self, None)
+        self.rewrite = (target, conjunct, bindings, lhs, rhs)
+
+    def __str__(self):
+        if self.text is None:
+            target, conjunct, bindings, lhs, rhs = self.rewrite
+            t, c = find_rewrite_mismatch(target, conjunct, bindings, lhs, rhs)
+            self.format = "niet bekomen door herschrijven van %s"
+            self.args = (target,)
+            if t is not target:
+                self.format += ": op de plaats van %s staat %s"
+                self.args += (t, c)
+            candidate = get_rewrite_candidate(t, bindings, lhs, rhs)
+            if candidate is not None:
+                self.format += " (herschrijven geeft daar %s)"
+                self.args += (candidate,)
+        return Diagnostic.__str__(self)
 
 class ProofError(LocError):
     pass
 
 def get_conjuncts(e):
-    if e[0] == 'and':
-        return get_conjuncts(e[1]) + get_conjuncts(e[2])
-    else:
-        return [e]
+    conjuncts = []
+    es = [e]
+    while es != []:
+        e = es.pop()
+        if e[0] == 'and':
+            es.append(e[2])
+            es.append(e[1])
+        else:
+            conjuncts.append(e)
+    return conjuncts
+
+statNames = ['match_calls', 'match_failures', 'rewrite_sites', 'poly_normalizations', 'poly_terms', 'cache_hits', 'cache_misses', 'inference_candidates']
+
+# The number of StepStats being collected and Budgets being charged, on any thread; the instrumented routines check it
+# before counting, so that counting costs next to nothing when neither is active
+statsCollectors = 0
+statsLock = threading.Lock()
+statsLocal = threading.local()
+
+def count(name, n=1):
+    """
+    Adds n to the counter name of the StepStats being collected on the current thread, if any, and charges it to the
+    Budget of the current thread, if any.
+    """
+    counters = getattr(statsLocal, 'counters', None)
+    if counters is not None:
+        counters[name] += n
+    budget = getattr(statsLocal, 'budget', None)
+    if budget is not None:
+        budget.charge(name, n)
+
+def check_term_size(e):
+    budget = getattr(statsLocal, 'budget', None)
+    if budget is not None:
+        budget.check_term_size(e)
+
+class ResourceLimitExceeded(LocError):
+    pass
+
+class Limits:
+    """
+    Limits on the resources used for checking, per step and per file; None means no limit. Times are in seconds.
+    rewrites limits the rewrite candidates tried, matchSteps the match calls, termSize the size of the terms of a step
+    and of the facts instantiated for it, and polyTerms the terms computed while multiplying polynomials.
+    """
+    names = ['stepTime', 'fileTime', 'rewrites', 'fileRewrites', 'matchSteps', 'fileMatchSteps', 'termSize', 'polyTerms']
+
+    def __init__(self, **limits):
+        for name in Limits.names:
+            setattr(self, name, limits.pop(name, None))
+        if limits:
+            raise ValueError("Unknown limits: %s" % ', '.join(sorted(limits)))
+
+    @classmethod
+    def parse(cls, text):
+        """Parses limits written as name=value pairs separated by commas, e.g. stepTime=0.5,matchSteps=100000."""
+        limits = {}
+        for item in text.split(','):
+            name, value = item.split('=')
+            name = name.strip()
+            limits[name] = float(value) if name in ('stepTime', 'fileTime') else int(value)
+        return cls(**limits)
+
+class Budget:
+    """
+    The resources used while checking one file against Limits. Entering the budget starts a step: until it is exited,
+    the work counted on the current thread is charged to the step and to the file, and exceeding a limit raises
+    ResourceLimitExceeded.
+    """
+    checkTimeEvery = 64
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.fileDeadline = None if limits.fileTime is None else time.perf_counter() + limits.fileTime
+        self.fileRewrites = 0
+        self.fileMatchSteps = 0
+
+    def __enter__(self):
+        global statsCollectors
+        limits = self.limits
+        if self.fileDeadline is not None and time.perf_counter() > self.fileDeadline:
+            raise ResourceLimitExceeded("Resource limit exceeded: time per file (%s s)" % limits.fileTime)
+        self.deadline = self.fileDeadline
+        if limits.stepTime is not None:
+            stepDeadline = time.perf_counter() + limits.stepTime
+            self.deadline = stepDeadline if self.deadline is None else min(self.deadline, stepDeadline)
+        self.rewrites = 0
+        self.matchSteps = 0
+        self.polyTerms = 0
+        self.charges = 0
+        self.outerBudget = getattr(statsLocal, 'budget', None)
+        statsLocal.budget = self
+        with statsLock:
+            statsCollectors += 1
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        global statsCollectors
+        statsLocal.budget = self.outerBudget
+        with statsLock:
+            statsCollectors -= 1
+        return False
+
+    def exceeded(self, what, limit):
+        raise ResourceLimitExceeded("Resource limit exceeded: %s (%s)" % (what, limit))
+
+    def charge(self, name, n):
+        limits = self.limits
+        if name == 'match_calls':
+            self.matchSteps += n
+            self.fileMatchSteps += n
+            if limits.matchSteps is not None and self.matchSteps > limits.matchSteps:
+                self.exceeded("match steps per step", limits.matchSteps)
+            if limits.fileMatchSteps is not None and self.fileMatchSteps > limits.fileMatchSteps:
+                self.exceeded("match steps per file", limits.fileMatchSteps)
+        elif name == 'rewrite_sites':
+            self.rewrites += n
+            self.fileRewrites += n
+            if limits.rewrites is not None and self.rewrites > limits.rewrites:
+                self.exceeded("rewrite candidates per step", limits.rewrites)
+            if limits.fileRewrites is not None and self.fileRewrites > limits.fileRewrites:
+                self.exceeded("rewrite candidates per file", limits.fileRewrites)
+        elif name == 'poly_terms':
+            self.polyTerms += n
+            if limits.polyTerms is not None and self.polyTerms > limits.polyTerms:
+                self.exceeded("polynomial terms per step", limits.polyTerms)
+        # Check the clock once per checkTimeEvery units of work, rather than once per charge, since a single charge may
+        # stand for a large polynomial product
+        self.charges += n
+        if self.deadline is not None and self.charges >= Budget.checkTimeEvery and time.perf_counter() > self.deadline:
+            if self.fileDeadline is not None and time.perf_counter() > self.fileDeadline:
+                self.exceeded("time per file", "%s s" % limits.fileTime)
+            self.exceeded("time per step", "%s s" % limits.stepTime)
+        if self.charges >= Budget.checkTimeEvery:
+            self.charges = 0
+
+    def check_term_size(self, e):
+        if self.limits.termSize is not None and e.size > self.limits.termSize:
+            self.exceeded("term size", self.limits.termSize)
+
+class StepStats:
+    """
+    A context manager that measures the wall time of the work done in its body, and counts the match calls, match
+    failures, rewrite sites, polynomial normalizations, normal form cache hits and misses, and justification inference
+    candidates on the current thread.
+    """
+    def __enter__(self):
+        global statsCollectors
+        self.counters = dict.fromkeys(statNames, 0)
+        self.outerCounters = getattr(statsLocal, 'counters', None)
+        statsLocal.counters = self.counters
+        with statsLock:
+            statsCollectors += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        global statsCollectors
+        self.time = time.perf_counter() - self.start
+        statsLocal.counters = self.outerCounters
+        with statsLock:
+            statsCollectors -= 1
+        return False
+
+    def to_dict(self):
+        d = {'time': self.time}
+        d.update(self.counters)
+        return d
+
+class LRUCache:
+    """A mapping with at most maxsize entries that evicts the least recently used one, with hit and miss counters."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                if statsCollectors:
+                    count('cache_misses')
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if statsCollectors:
+                count('cache_hits')
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            while len(self.entries) > maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+polyCache = LRUCache(4096)
+polycCache = LRUCache(4096)
+normalizeEqCache = LRUCache(4096)
+lawInstanceCache = LRUCache(4096)
+acNormalFormCache = LRUCache(4096)
+# The verdicts on steps, by step key (see get_step_key): None or the ProofError, shared by all outlines checked
+stepVerdictCache = LRUCache(4096)
+
+caches = {'poly': polyCache, 'polyc': polycCache, 'normalize_eq': normalizeEqCache, 'law_instance': lawInstanceCache, 'ac_normal_form': acNormalFormCache, 'step_verdict': stepVerdictCache}
+
+def set_cache_size(maxsize):
+    """Bounds each of the normal form, law instantiation and step verdict caches to maxsize entries."""
+    for cache in caches.values():
+        cache.resize(maxsize)
+
+def get_cache_info():
+    return dict((name, cache.info()) for name, cache in caches.items())
+
+missing = object()
+
+# Polynomials are tuples of (monomial, coefficient) pairs, sorted by monomial, with nonzero int coefficients. A
+# monomial is the id of an interned exponent vector: a tuple of (atom, exponent) pairs sorted by atom, where an atom is
+# the index of a subterm that is not an arithmetic operation. Monomial 0 is the empty vector, i.e. the constant 1.
+# The tables are cleared together with the term intern table (see trim_intern_tables).
+
+atomIndices = {}
+monomials = [()]
+monomialIds = {(): 0}
+monomialProducts = {}
+monomialLock = threading.Lock()
+
+def intern_monomial(vector):
+    monomial = monomialIds.get(vector)
+    if monomial is None:
+        with monomialLock:
+            monomial = monomialIds.get(vector)
+            if monomial is None:
+                monomial = len(monomials)
+                monomials.append(vector)
+                monomialIds[vector] = monomial
+    return monomial
+
+def get_atom_monomial(e):
+    atom = atomIndices.get(e)
+    if atom is None:
+        with monomialLock:
+            atom = atomIndices.setdefault(e, len(atomIndices))
+    return intern_monomial(((atom, 1),))
+
+def get_monomial_table_size():
+    """Returns the number of atoms, monomials and monomial products in the tables; all of them are kept alive there."""
+    return len(atomIndices) + len(monomials) + len(monomialProducts)
+
+def clear_monomial_table():
+    """Forgets all atoms and monomials, and therefore all cached polynomials."""
+    with monomialLock:
+        atomIndices.clear()
+        del monomials[1:]
+        monomialIds.clear()
+        monomialIds[()] = 0
+        monomialProducts.clear()
+    polyCache.clear()
+    polycCache.clear()
+
+def mul_monomials(monomial1, monomial2):
+    if monomial1 == 0:
+        return monomial2
+    if monomial2 == 0:
+        return monomial1
+    key = (monomial1, monomial2)
+    product = monomialProducts.get(key)
+    if product is None:
+        vector1 = monomials[monomial1]
+        vector2 = monomials[monomial2]
+        vector = []
+        i = j = 0
+        while i < len(vector1) and j < len(vector2):
+            atom1, exponent1 = vector1[i]
+            atom2, exponent2 = vector2[j]
+            if atom1 < atom2:
+                vector.append(vector1[i])
+                i += 1
+            elif atom2 < atom1:
+                vector.append(vector2[j])
+                j += 1
+            else:
+                vector.append((atom1, exponent1 + exponent2))
+                i += 1
+                j += 1
+        vector.extend(vector1[i:])
+        vector.extend(vector2[j:])
+        product = intern_monomial(tuple(vector))
+        monomialProducts[key] = product
+    return product
 
 def add_polys(poly1, poly2):
-    poly1Keys = set(poly1.keys())
-    poly2Keys = set(poly2.keys())
-    result = {}
-    for key in poly1Keys - poly2Keys:
-        result[key] = poly1[key]
-    for key in poly2Keys - poly1Keys:
-        result[key] = poly2[key]
-    for key in poly1Keys & poly2Keys:
-        value = poly1[key] + poly2[key]
-        if value == 0:
-            pass
+    if poly1 == ():
+        return poly2
+    if poly2 == ():
+        return poly1
+    result = []
+    i = j = 0
+    n1 = len(poly1)
+    n2 = len(poly2)
+    while i < n1 and j < n2:
+        monomial1, coef1 = poly1[i]
+        monomial2, coef2 = poly2[j]
+        if monomial1 < monomial2:
+            result.append(poly1[i])
+            i += 1
+        elif monomial2 < monomial1:
+            result.append(poly2[j])
+            j += 1
         else:
-            result[key] = value
-    return result
+            coef = coef1 + coef2
+            if coef != 0:
+                result.append((monomial1, coef))
+            i += 1
+            j += 1
+    result.extend(poly1[i:])
+    result.extend(poly2[j:])
+    return tuple(result)
 
 def scale_poly(coef, poly):
     if coef == 0:
-        return {}
+        return ()
     else:
-        result = {}
-        for key in poly.keys():
-            result[key] = coef * poly[key]
-        return result
+        return tuple((monomial, coef * coef1) for monomial, coef1 in poly)
+
+def mul_polys(poly1, poly2):
+    if len(poly2) < len(poly1):
+        poly1, poly2 = poly2, poly1
+    result = ()
+    for monomial1, coef1 in poly1:
+        if statsCollectors:
+            count('poly_terms', len(poly2))
+        # Multiplying by a monomial is injective, but need not preserve the order of the monomials
+        result = add_polys(result, tuple(sorted((mul_monomials(monomial1, monomial2), coef1 * coef2) for monomial2, coef2 in poly2)))
+    return result
 
 def get_poly(e):
-    if e[0] == 'var':
-        return {(e,): 1}
-    elif e[0] == 'int':
+    """Returns the polynomial normal form of e, treating subterms other than +, - and * as variables."""
+    poly = polyCache.get(e, missing)
+    if poly is missing:
+        poly = compute_poly(e)
+        polyCache.put(e, poly)
+    return poly
+
+def compute_poly(e):
+    if statsCollectors:
+        count('poly_normalizations')
+    if e[0] == 'int':
         if e[1] == 0:
-            return {}
+            return ()
         else:
-            return {(): e[1]}
-    elif e[0] == '+':
-        poly1 = get_poly(e[1])
-        poly2 = get_poly(e[2])
-        return add_polys(poly1, poly2)
-    elif e[0] == '-':
+            return ((0, e[1]),)
+    elif e[0] in ('+', '-'):
+        # Sum all terms of a chain of additions and subtractions at once; merging them one by one would take time
+        # quadratic in the length of the chain
+        coefs = {}
+        terms = [(e, 1)]
+        while terms != []:
+            e1, sign = terms.pop()
+            if e1[0] == '+' or e1[0] == '-':
+                terms.append((e1[1], sign))
+                terms.append((e1[2], sign if e1[0] == '+' else -sign))
+            else:
+                for monomial, coef in get_poly(e1):
+                    coefs[monomial] = coefs.get(monomial, 0) + sign * coef
+        return tuple(sorted((monomial, coef) for monomial, coef in coefs.items() if coef != 0))
+    elif e[0] == '*':
         poly1 = get_poly(e[1])
         poly2 = get_poly(e[2])
-        return add_polys(poly1, scale_poly(-1, poly2))
+        return mul_polys(poly1, poly2)
     else:
-        return {(e,): 1}
+        return ((get_atom_monomial(e), 1),)
 
 def is_tautology(e):
     if e[0] not in ['==', '<=', '!=']:
         return False
-    poly = get_poly(('-', e[2], e[1]))
+    poly = get_poly(mk_term('-', e[2], e[1]))
     if e[0] == '==':
-        return poly == {}
+        return poly == ()
     elif e[0] == '!=':
-        return set(poly.keys()) == {()} and 0 != poly[()]
+        return len(poly) == 1 and poly[0][0] == 0
     elif e[0] == '<=':
-        return set(poly.keys()) == set() or set(poly.keys()) == {()} and 0 <= poly[()]
+        return poly == () or len(poly) == 1 and poly[0][0] == 0 and 0 <= poly[0][1]
 
 def normalize_eq(e):
     """Rewrites an equation to a form not involving not or <, i.e. involving only ==, <=, or !="""
+    result = normalizeEqCache.get(e)
+    if result is None:
+        result = compute_normalize_eq(e)
+        normalizeEqCache.put(e, result)
+    return result
+
+def compute_normalize_eq(e):
     if e[0] == 'not':
         e1 = normalize_eq(e[1])
         if e1[0] == 'not':
             e = e1[1]
         elif e1[0] == '==':
-            e = ('!=', e1[1], e1[2])
+            e = mk_term('!=', e1[1], e1[2])
         elif e1[0] == '!=':
-            e = ('==', e1[1], e1[2])
+            e = mk_term('==', e1[1], e1[2])
         elif e1[0] == '<=':
-            e = ('<=', e1[2], ('+', ('int', -1), e1[1]))
+            e = mk_term('<=', e1[2], mk_term('+', mk_term('int', -1), e1[1]))
         else:
             return e
     if e[0] == '<':
-        return ('<=', e[1], ('+', ('int', -1), e[2]))
+        return mk_term('<=', e[1], mk_term('+', mk_term('int', -1), e[2]))
     return e
 
 def get_polyc(eq):
-    poly = get_poly(('-', eq[2], eq[1]))
-    c = Fraction(0)
-    if () in poly:
-        c = Fraction(poly[()])
-        del poly[()]
+    result = polycCache.get(eq)
+    if result is None:
+        result = compute_polyc(eq)
+        polycCache.put(eq, result)
+    return result
+
+def compute_polyc(eq):
+    """
+    Returns (op, c, poly) such that eq is equivalent in Z to 0 op poly + c, where the coefficients of poly have no
+    common divisor and, if op is == or !=, the first one is positive. If eq is unsatisfiable in Z, op is 'False'; if it
+    is valid in Z, op may be 'True'.
+    """
+    poly = get_poly(mk_term('-', eq[2], eq[1]))
+    c = 0
+    if poly != () and poly[0][0] == 0:
+        c = poly[0][1]
+        poly = poly[1:]
     op = eq[0]
-    if poly != {}:
-        gcd = math.gcd(*poly.values())
-        if op == '==' or op == '!=' and poly[min(poly.keys())] < 0:
-            gcd *= -1
-        for key in list(poly.keys()):
-            poly[key] /= gcd
-        c /= gcd
+    if poly != ():
+        gcd = math.gcd(*[coef for _, coef in poly])
+        if op == '<=':
+            # 0 <= gcd * p + c iff 0 <= p + c / gcd iff 0 <= p + floor(c / gcd), since p is an integer
+            c //= gcd
+        elif c % gcd != 0:
+            return ('False' if op == '==' else 'True'), 0, ()
+        else:
+            if poly[0][1] < 0:
+                gcd *= -1
+            c //= gcd
+        poly = tuple((monomial, coef // gcd) for monomial, coef in poly)
     return op, c, poly
 
 def follows_in_Z_from(consequent, antecedent):
@@ -469,6 +1243,10 @@ def follows_in_Z_from(consequent, antecedent):
         return False
     op1, c1, poly1 = get_polyc(antecedent)
     op2, c2, poly2 = get_polyc(consequent)
+    if op2 == 'True' or op1 == 'False':
+        return True
+    if op1 == 'True' or op2 == 'False':
+        return False
     # print('Checking entailment in Z: %s ==> %s' % ((op1, c1, poly1), (op2, c2, poly2)))
     if op2 == '==':
         return (c2, poly2) == (c1, poly1)
@@ -490,108 +1268,528 @@ def follows_in_Z_from(consequent, antecedent):
 class MatchFailure(ProofError):
     pass
 
-def match(bindings, e1, e2):
+acOperators = {'and', '+', '*'}
+
+def get_ac_args(e):
     """
-    Extends the bindings so that subst(bindings, e1) == e2, or raises a ProofError.
+    Returns the arguments, from left to right, of the maximal tree of e[0] nodes at e, where e[0] is an associative
+    and commutative operator: e.g. [a, b, c] for a + (b + c).
     """
-    if e1[0] == 'var':
-        x = e1[1]
-        if x in bindings:
-            if e2 != bindings[x]:
-                raise MatchFailure("Match failure: expected: %s; found: %s" % (bindings[x], e2))
+    op = e[0]
+    args = []
+    stack = []
+    while True:
+        if e[0] == op:
+            stack.append(e[2])
+            e = e[1]
         else:
-            bindings[x] = e2
+            args.append(e)
+            if stack == []:
+                return args
+            e = stack.pop()
+
+def build_ac_term(op, args):
+    """Returns the op term with the given arguments, nested as the parser nests them: to the right for and."""
+    if op == 'and':
+        e = args[-1]
+        for arg in reversed(args[:-1]):
+            e = mk_term(op, arg, e)
     else:
-        if e1[0] != e2[0]:
-            raise MatchFailure("Match failure: %s is not of the form %s" % (e2, e1))
-        if e1[0] in symmetricBinaryOperators:
-            # Take symmetry/commutativity into account
-            bindings1 = dict(bindings)
-            try:
-                match(bindings1, e1[1], e2[1])
-                match(bindings1, e1[2], e2[2])
-                bindings.update(bindings1)
-            except MatchFailure:
-                match(bindings, e1[1], e2[2])
-                match(bindings, e1[2], e2[1])
-        elif e1[0] in binaryOperators:
-            match(bindings, e1[1], e2[1])
-            match(bindings, e1[2], e2[2])
-        elif e1[0] in unaryOperators:
-            match(bindings, e1[1], e2[1])
-        elif e1[0] in nullaryOperators:
-            pass
-        elif e1[0] == 'call':
-            if e1[1] != e2[1]:
-                raise MatchFailure("Match failure: %s is not of the form %s" % (e2, e1))
-            for arg1, arg2 in zip(e1[2], e2[2]):
-                match(bindings, arg1, arg2)
-        elif e1[0] == 'int':
-            if e1 != e2:
-                raise MatchFailure("Match failure: expected: %s; found: %s" % (e1, e2))
-        else:
-            raise ProofError("match: construct not supported: %s" % e1)
+        e = args[0]
+        for arg in args[1:]:
+            e = mk_term(op, e, arg)
+    return e
 
-def matches(e1, e2, bindings):
-    """Returns whether bindings can be extended so that subst(e2, bindings) == e1"""
-    try:
-        match(dict(bindings), e2, e1)
+def get_ac_normal_form(e):
+    """
+    Returns the normal form of e modulo associativity and commutativity of the operators in acOperators and
+    commutativity of ==: the arguments of each such operator are sorted.
+    """
+    if e.size == 1:
+        return e
+    result = acNormalFormCache.get(e)
+    if result is None:
+        result = compute_ac_normal_form(e)
+        acNormalFormCache.put(e, result)
+    return result
+
+def compute_ac_normal_form(e):
+    kind = e[0]
+    if kind in acOperators:
+        return build_ac_term(kind, sorted(get_ac_normal_form(arg) for arg in get_ac_args(e)))
+    elif kind in binaryOperators:
+        return normalize(mk_term(kind, get_ac_normal_form(e[1]), get_ac_normal_form(e[2])))
+    elif kind in unaryOperators:
+        return mk_term(kind, get_ac_normal_form(e[1]))
+    elif kind == 'call':
+        return mk_term('call', e[1], tuple(get_ac_normal_form(arg) for arg in e[2]))
+    else:
+        return e
+
+def ac_equal(e1, e2):
+    """Returns whether e1 and e2 are equal modulo associativity and commutativity (see get_ac_normal_form)."""
+    if e1 == e2:
         return True
-    except MatchFailure:
+    if e1.size != e2.size or e1[0] != e2[0]:
         return False
+    return get_ac_normal_form(e1) == get_ac_normal_form(e2)
 
-freshVarCounter = 0
+def get_surjections(n, k):
+    """
+    Generates, in lexicographic order, the lists of n block numbers below k in which each block number occurs. The
+    first one is [0, ..., 0, 1, ..., k - 1]. The same list object is updated and generated each time.
+    """
+    blocks = [0] * (n - k + 1) + list(range(1, k))
+    counts = [n - k + 1] + [1] * (k - 1)
+    empty = 0
+    while True:
+        yield blocks
+        # Increment the rightmost position that can be incremented without leaving too few positions for the empty
+        # blocks...
+        i = n - 1
+        while True:
+            if i < 0:
+                return
+            counts[blocks[i]] -= 1
+            if counts[blocks[i]] == 0:
+                empty += 1
+            for b in range(blocks[i] + 1, k):
+                if empty - (counts[b] == 0) <= n - i - 1:
+                    break
+            else:
+                i -= 1
+                continue
+            break
+        # ...and fill in the positions after it with the smallest block numbers that leave enough positions
+        while True:
+            if counts[b] == 0:
+                empty -= 1
+            counts[b] += 1
+            blocks[i] = b
+            i += 1
+            if i == n:
+                break
+            b = 0 if empty <= n - i - 1 else counts.index(0)
 
-def get_fresh_var_name():
-    global freshVarCounter
+def match_pair(bindings, pattern, e, trail, agenda):
+    """
+    Performs the first step of matching pattern against e for match_agenda: returns True after pushing the remaining
+    subproblems onto the agenda, False on failure, or an iterator over the alternative lists of subproblems.
+    """
+    if statsCollectors:
+        count('match_calls')
+    kind = pattern[0]
+    if kind == 'var':
+        x = pattern[1]
+        bound = bindings.get(x)
+        if bound is None:
+            bindings[x] = e
+            trail.append(x)
+            return True
+        if ac_equal(e, bound):
+            return True
+    elif not pattern.freeVars:
+        if ac_equal(e, pattern):
+            return True
+    elif kind != e[0]:
+        pass
+    elif kind in acOperators:
+        patterns = getattr(pattern, 'acArgs', None)
+        if patterns is None:
+            patterns = pattern.acArgs = tuple(get_ac_args(pattern))
+        es = get_ac_args(e)
+        # Each argument of the pattern matches at least one argument of e
+        if len(patterns) <= len(es):
+            agenda.append((kind, patterns, es))
+            return True
+    elif kind in symmetricBinaryOperators:
+        if e[1] == e[2]:
+            agenda.append((pattern[2], e[2]))
+            agenda.append((pattern[1], e[1]))
+            return True
+        return iter([[(pattern[2], e[2]), (pattern[1], e[1])], [(pattern[2], e[1]), (pattern[1], e[2])]])
+    elif kind in binaryOperators:
+        agenda.append((pattern[2], e[2]))
+        agenda.append((pattern[1], e[1]))
+        return True
+    elif kind in unaryOperators:
+        agenda.append((pattern[1], e[1]))
+        return True
+    elif kind == 'call':
+        if pattern[1] == e[1]:
+            # Extra arguments on either side are ignored, as they always have been
+            agenda.extend(reversed(list(zip(pattern[2], e[2]))))
+            return True
+    else:
+        raise ProofError("match: construct not supported: %s" % (pattern,))
+    if statsCollectors:
+        count('match_failures')
+    return False
 
-    result = "#x%d" % freshVarCounter
-    freshVarCounter += 1
-    return result
+def match_ac_args(bindings, op, patterns, es, trail, agenda):
+    """
+    Performs the first step of matching the op term with arguments patterns against the op term with arguments es, for
+    match_agenda; see match_pair. The arguments that are not variables are matched first, each against one of es with
+    the same head; then the arguments of the values of the bound variables are removed from es, and the remaining
+    ones are split among the unbound variables, preferring the split in which the first variable takes all but one
+    argument per other variable.
+    """
+    if statsCollectors:
+        count('match_calls')
+    for i, pattern in enumerate(patterns):
+        if pattern[0] == 'var':
+            continue
+        rest = patterns[:i] + patterns[i + 1:]
+        candidates = []
+        seen = set()
+        for j, e in enumerate(es):
+            if e[0] != pattern[0] or pattern[0] == 'call' and e[1] != pattern[1] or id(e) in seen:
+                continue
+            if not pattern.freeVars and not ac_equal(e, pattern):
+                continue
+            seen.add(id(e))
+            candidates.append(j)
+        if len(candidates) == 1:
+            j = candidates[0]
+            agenda.append((op, rest, es[:j] + es[j + 1:]))
+            agenda.append((pattern, es[j]))
+            return True
+        if candidates != []:
+            return ([(op, rest, es[:j] + es[j + 1:]), (pattern, es[j])] for j in candidates)
+        if statsCollectors:
+            count('match_failures')
+        return False
+    es = list(es)
+    unbound = []
+    for pattern in patterns:
+        value = bindings.get(pattern[1])
+        if value is None:
+            unbound.append(pattern)
+            continue
+        for arg in get_ac_args(value) if value[0] == op else [value]:
+            for j, e in enumerate(es):
+                if ac_equal(e, arg):
+                    del es[j]
+                    break
+            else:
+                if statsCollectors:
+                    count('match_failures')
+                return False
+    if len(unbound) > len(es) or unbound == [] and es != []:
+        if statsCollectors:
+            count('match_failures')
+        return False
+    if unbound == []:
+        return True
+    if len(unbound) == 1:
+        x = unbound[0][1]
+        bindings[x] = build_ac_term(op, es)
+        trail.append(x)
+        return True
+    names = [pattern[1] for pattern in unbound]
+    if len(set(names)) == len(names):
+        def get_splits():
+            for blocks in get_surjections(len(es), len(unbound)):
+                args = [[] for _ in unbound]
+                for e, b in zip(es, blocks):
+                    args[b].append(e)
+                yield [(pattern, build_ac_term(op, args[b])) for b, pattern in enumerate(unbound)]
+        return get_splits()
+    # A variable that occurs m times takes m times the same arguments, so only arguments that occur at least m times
+    # among es are candidates; choose them first
+    pattern = next(pattern for pattern in unbound if names.count(pattern[1]) > 1)
+    m = names.count(pattern[1])
+    normalForms = [get_ac_normal_form(e) for e in es]
+    counts = {}
+    for normalForm in normalForms:
+        counts[normalForm] = counts.get(normalForm, 0) + 1
+    if m == len(names):
+        # The variable is the only one left, so it takes each argument count / m times
+        if any(k % m != 0 for k in counts.values()):
+            if statsCollectors:
+                count('match_failures')
+            return False
+        value = []
+        for e, normalForm in zip(es, normalForms):
+            k = counts.pop(normalForm, None)
+            if k is not None:
+                value.extend([e] * (k // m))
+        agenda.append((op, unbound, es))
+        agenda.append((pattern, build_ac_term(op, value)))
+        return True
+    candidates = [j for j, normalForm in enumerate(normalForms) if counts[normalForm] >= m]
+    return ([(op, unbound, es), (pattern, build_ac_term(op, [es[j] for j in indices]))]
+            for size in range(1, len(candidates) // m + 1) for indices in itertools.combinations(candidates, size))
+
+def match_agenda(bindings, agenda, trail):
+    """
+    Solves the matching problems on the agenda, a stack of (pattern, e) pairs and (op, patterns, es) triples (the op
+    term with arguments patterns must match the op term with arguments es), by extending the bindings, and returns
+    True, or returns False. Backtracks over the choices at symmetric operators and returns at the first solution.
+    """
+    choicePoints = []
+    while True:
+        if agenda == []:
+            return True
+        item = agenda.pop()
+        if len(item) == 2:
+            pattern, e = item
+            if pattern[0] == 'var' and pattern[1] not in bindings:
+                # The most frequent case, inlined
+                if statsCollectors:
+                    count('match_calls')
+                bindings[pattern[1]] = e
+                trail.append(pattern[1])
+                continue
+            alternatives = match_pair(bindings, pattern, e, trail, agenda)
+        else:
+            alternatives = match_ac_args(bindings, item[0], item[1], item[2], trail, agenda)
+        if alternatives is True:
+            continue
+        if alternatives is not False:
+            choicePoints.append((len(trail), tuple(agenda), alternatives))
+        while True:
+            if choicePoints == []:
+                return False
+            mark, savedAgenda, alternatives = choicePoints[-1]
+            alternative = next(alternatives, None)
+            if alternative is not None:
+                break
+            choicePoints.pop()
+        undo_bindings(bindings, trail, mark)
+        agenda = list(savedAgenda)
+        agenda.extend(alternative)
+
+def try_match(bindings, e1, e2, trail):
+    """
+    Extends the bindings so that subst(bindings, e1) equals e2 modulo associativity and commutativity (see ac_equal)
+    and returns True, or returns False. The variables bound are appended to trail, so that the bindings can be
+    restored with undo_bindings; after a failure, some of them may be bound. No failure message is built; see
+    explain_match_failure.
+    """
+    matcher = get_compiled_matcher(e1)
+    if matcher is not None:
+        return matcher(e2, bindings, trail)
+    return match_agenda(bindings, [(e1, e2)], trail)
+
+def try_match_all(bindings, pairs, trail):
+    """
+    Like try_match, for all (pattern, e) pairs at once. The deterministic patterns are matched first, one by one, with
+    their compiled matchers; since they match in at most one way, this finds a solution if there is one.
+    """
+    agenda = []
+    for pattern, e in pairs:
+        matcher = get_compiled_matcher(pattern)
+        if matcher is None:
+            agenda.append((pattern, e))
+        elif not matcher(e, bindings, trail):
+            return False
+    agenda.reverse()
+    return match_agenda(bindings, agenda, trail)
+
+def undo_bindings(bindings, trail, mark):
+    """Removes the bindings of the variables appended to trail since it had length mark."""
+    while len(trail) > mark:
+        del bindings[trail.pop()]
+
+def is_deterministic_pattern(pattern):
+    """Returns whether pattern has no symmetric operators with variables, so that it matches a term in one way."""
+    stack = [pattern]
+    while stack != []:
+        pattern = stack.pop()
+        if pattern.freeVars:
+            if pattern[0] in symmetricBinaryOperators:
+                return False
+            stack.extend(get_children(pattern))
+    return True
+
+def get_compiled_matcher(pattern):
+    """
+    Returns the compiled matcher for pattern (see compile_pattern) if it is deterministic, or else None. The result is
+    kept in the pattern term itself.
+    """
+    matcher = getattr(pattern, 'matcher', missing)
+    if matcher is missing:
+        matcher = pattern.matcher = compile_pattern(pattern) if is_deterministic_pattern(pattern) else None
+    return matcher
+
+def compile_pattern(pattern):
+    """
+    Returns a matcher for a deterministic pattern (see is_deterministic_pattern): a function m(e, bindings, trail)
+    that does what try_match(bindings, pattern, e, trail) does, with the dispatch on the pattern's node kinds done
+    once, here.
+    """
+    kind = pattern[0]
+    if kind == 'var':
+        x = pattern[1]
+        def matcher(e, bindings, trail):
+            if statsCollectors:
+                count('match_calls')
+            bound = bindings.get(x)
+            if bound is None:
+                bindings[x] = e
+                trail.append(x)
+                return True
+            if ac_equal(e, bound):
+                return True
+            if statsCollectors:
+                count('match_failures')
+            return False
+    elif not pattern.freeVars:
+        def matcher(e, bindings, trail):
+            if statsCollectors:
+                count('match_calls')
+            if ac_equal(e, pattern):
+                return True
+            if statsCollectors:
+                count('match_failures')
+            return False
+    elif kind in binaryOperators:
+        match1 = compile_pattern(pattern[1])
+        match2 = compile_pattern(pattern[2])
+        def matcher(e, bindings, trail):
+            if statsCollectors:
+                count('match_calls')
+            if e[0] != kind:
+                if statsCollectors:
+                    count('match_failures')
+                return False
+            return match1(e[1], bindings, trail) and match2(e[2], bindings, trail)
+    elif kind in unaryOperators:
+        match1 = compile_pattern(pattern[1])
+        def matcher(e, bindings, trail):
+            if statsCollectors:
+                count('match_calls')
+            if e[0] != kind:
+                if statsCollectors:
+                    count('match_failures')
+                return False
+            return match1(e[1], bindings, trail)
+    elif kind == 'call':
+        name = pattern[1]
+        argMatchers = [compile_pattern(arg) for arg in pattern[2]]
+        def matcher(e, bindings, trail):
+            if statsCollectors:
+                count('match_calls')
+            if e[0] != 'call' or e[1] != name:
+                if statsCollectors:
+                    count('match_failures')
+                return False
+            # Like try_match, this ignores extra arguments on either side
+            for argMatcher, arg in zip(argMatchers, e[2]):
+                if not argMatcher(arg, bindings, trail):
+                    return False
+            return True
+    else:
+        raise ProofError("match: construct not supported: %s" % (pattern,))
+    return matcher
+
+def explain_match_failure(bindings, e1, e2):
+    """
+    Returns the Diagnostic explaining why try_match(bindings, e1, e2, trail) fails, or None if it succeeds. Extends
+    the bindings like try_match.
+    """
+    trail = []
+    if try_match(bindings, e1, e2, trail):
+        return None
+    undo_bindings(bindings, trail, 0)
+    if e1[0] == 'var':
+        return Diagnostic("Match failure: expected: %s; found: %s", bindings[e1[1]], e2)
+    if e1[0] == 'int':
+        return Diagnostic("Match failure: expected: %s; found: %s", e1, e2)
+    if e1[0] == e2[0] and e1[0] not in symmetricBinaryOperators and e1.freeVars:
+        if e1[0] in binaryOperators or e1[0] in unaryOperators:
+            children = zip(get_children(e1), get_children(e2))
+        elif e1[1] == e2[1]:
+            children = zip(e1[2], e2[2])
+        else:
+            children = []
+        for child1, child2 in children:
+            message = explain_match_failure(bindings, child1, child2)
+            if message is not None:
+                return message
+    return Diagnostic("Match failure: %s is not of the form %s", e2, e1)
+
+freshVarCounter = itertools.count()
+
+def get_fresh_var_name():
+    return "#x%d" % next(freshVarCounter)
 
-def subst(e, bindings):
+def subst(e, bindings, fresh_var_name=get_fresh_var_name):
     if e[0] == 'var':
         if e[1] not in bindings:
-            x = get_fresh_var_name()
-            bindings[e[1]] = ('var', x)
+            x = fresh_var_name()
+            bindings[e[1]] = mk_term('var', x)
         return bindings[e[1]]
     elif e[0] in binaryOperators:
-        return (e[0], subst(e[1], bindings), subst(e[2], bindings))
+        return mk_term(e[0], subst(e[1], bindings, fresh_var_name), subst(e[2], bindings, fresh_var_name))
     elif e[0] in unaryOperators:
-        return (e[0], subst(e[1], bindings))
+        return mk_term(e[0], subst(e[1], bindings, fresh_var_name))
     elif e[0] in nullaryOperators:
         return e
     elif e[0] == 'call':
-        return ('call', e[1], tuple(map(lambda arg: subst(arg, bindings), e[2])))
+        return mk_term('call', e[1], tuple(map(lambda arg: subst(arg, bindings, fresh_var_name), e[2])))
     elif e[0] == 'int':
         return e
     else:
         raise ProofError("subst: construct not supported: %s" % (e,))
 
 def get_free_vars(e):
-    if e[0] == 'var':
-        return {e[1]}
-    elif e[0] in binaryOperators:
-        return get_free_vars(e[1]).union(get_free_vars(e[2]))
-    elif e[0] in unaryOperators:
-        return get_free_vars(e[1])
-    elif e[0] in nullaryOperators:
-        return set()
-    elif e[0] == 'call':
-        return set().union(*map(get_free_vars, e[2]))
-    elif e[0] == 'int':
-        return set()
-    else:
-        raise AssertionError("Unsupported construct: %s" % (e,))
+    return e.freeVars
 
 def normalize(eq):
     if eq[0] == '==' and eq[2] < eq[1]:
-        return ('==', eq[2], eq[1])
+        return mk_term('==', eq[2], eq[1])
     return eq
 
-laws = {}
+def get_canonical_key(e):
+    """
+    Returns the key of conjunct e in the index of an Antecedent: its normal form modulo associativity and
+    commutativity (see get_ac_normal_form), with the sides of a disequality oriented like those of an equality.
+    """
+    e = get_ac_normal_form(e)
+    if e[0] == '!=' and e[2] < e[1]:
+        return mk_term('!=', e[2], e[1])
+    return e
 
-def check_entailment(line, antecedent, consequent, justification):
+class Antecedent(list):
+    """
+    The list of the conjuncts of an assertion, with an index of their canonical keys (see get_canonical_key) and of
+    the positions of the conjuncts with each head symbol, built when it is first needed. A conjunct is in an
+    Antecedent if a conjunct with the same canonical key is, e.g. y == x if x == y is.
+    """
+    def __init__(self, conjuncts=()):
+        list.__init__(self, conjuncts)
+        self.keys = None
+        self.heads = None
+
+    def build_index(self):
+        self.keys = {}
+        self.heads = {}
+        for i, conjunct in enumerate(self, 1):
+            self.keys.setdefault(get_canonical_key(conjunct), i)
+            self.heads.setdefault(conjunct.head, []).append(i)
+
+    def __contains__(self, conjunct):
+        if self.keys is None:
+            self.build_index()
+        return get_canonical_key(conjunct) in self.keys
+
+    def get_indices_with_head(self, head):
+        """Returns the positions, from 1, of the conjuncts with the given head symbol."""
+        if self.heads is None:
+            self.build_index()
+        return self.heads.get(head, [])
+
+    def get_candidate_indices(self, pattern):
+        """Returns the positions of the conjuncts that pattern may match."""
+        if pattern[0] == 'var':
+            return range(1, len(self) + 1)
+        return self.get_indices_with_head(pattern.head)
+
+def check_entailment(laws, line, antecedent, consequent, justification, fresh_var_name=get_fresh_var_name):
+    if not isinstance(antecedent, Antecedent):
+        antecedent = Antecedent(antecedent)
     try:
         def get_conjunct(i):
             if i < 1 or len(antecedent) < i:
@@ -601,41 +1799,58 @@ def check_entailment(line, antecedent, consequent, justification):
         def get_fact(factSpec):
             if factSpec[0] == 'antecedent':
                 conjunct = get_conjunct(factSpec[1])
-                return dict(map(lambda x: (x, ('var', x)), get_free_vars(conjunct))), conjunct
+                return dict(map(lambda x: (x, mk_term('var', x)), get_free_vars(conjunct))), conjunct
             elif factSpec[0] == 'law':
                 _, lawName, arguments = factSpec
                 if lawName not in laws:
                     raise ProofError("No such law: %s" % lawName)
-                premisses, conclusion = laws[lawName]
+                law = laws[lawName]
+                premisses, conclusion = law
                 if len(arguments) != len(premisses):
                     raise ProofError("De wet %s verwacht %d argumenten; %d gegeven" % (lawName, len(premisses), len(arguments)))
-                variableBindings = {}
-                for premiss, argument in zip(premisses, arguments):
+                argTerms = []
+                for argument in arguments:
                     argBindings, argTerm = get_fact(argument)
                     if set(get_free_vars(argTerm)) != set(argBindings.keys()):
-                        raise ProofError("Law application requires fully instantiated arguments. Argument %s with bindings %s has uninstantiated pattern variables" % (argTerm, argBindings))
-                    argTerm = subst(argTerm, argBindings)
-                    match(variableBindings, premiss, argTerm)
-                return variableBindings, conclusion
+                        raise ProofError(Diagnostic("Law application requires fully instantiated arguments. Argument %s with bindings %s has uninstantiated pattern variables", argTerm, argBindings))
+                    argTerms.append(subst(argTerm, argBindings, fresh_var_name))
+                    if statsCollectors:
+                        check_term_size(argTerms[-1])
+                key = (law, tuple(argTerms))
+                variableBindings = lawInstanceCache.get(key)
+                if variableBindings is None:
+                    variableBindings = {}
+                    trail = []
+                    if not try_match_all(variableBindings, list(zip(premisses, argTerms)), trail):
+                        undo_bindings(variableBindings, trail, 0)
+                        # Matching the premisses one by one, the first one that fails is the one to report
+                        for premiss, argTerm in zip(premisses, argTerms):
+                            message = explain_match_failure(variableBindings, premiss, argTerm)
+                            if message is not None:
+                                raise MatchFailure(message)
+                    lawInstanceCache.put(key, variableBindings)
+                return dict(variableBindings), conclusion
             else:
                 raise ProofError("Unsupported fact specification form %s" % (factSpec,))
 
         # print("Checking entailment %s ==> %s" % (antecedent, consequent))
 
         def get_entailment_checker(justification):
-            if justification[0] == 'Herschrijven':
+            if justification is None:
+                def checker(conjunct):
+                    return "geen verantwoording"
+                return checker
+            elif justification[0] == 'Herschrijven':
                 _, i, j = justification
                 bindings, equation = get_fact(i)
                 target = get_conjunct(j)
                 if equation[0] != '==':
-                    raise ProofError("Kan niet herschrijven met " + str(equation) + " want is geen gelijkheid")
-                rewrites = get_rewrites(target, bindings, equation[1], equation[2])
-                targetBindings = dict((x, ('var', x)) for x in get_free_vars(target))
+                    raise ProofError(Diagnostic("Kan niet herschrijven met %s want is geen gelijkheid", equation))
                 def checker(conjunct):
-                    if any(matches(conjunct, rewrite, targetBindings) for rewrite in rewrites):
+                    if rewrites_to(target, conjunct, bindings, equation[1], equation[2]):
                         return None
                     else:
-                        return "rewrites = " + str(rewrites) + ")"
+                        return RewriteFailure(target, conjunct, bindings, equation[1], equation[2])
                 return checker
             elif justification[0] == 'Z':
                 if justification[1] == None:
@@ -645,8 +1860,10 @@ def check_entailment(line, antecedent, consequent, justification):
                 else:
                     bindings, fact = get_fact(justification[1])
                     if set(get_free_vars(fact)) != set(bindings.keys()):
-                        raise ProofError("Z justification requires fully instantiated fact. Fact %s under bindings %s has uninstantiated pattern variables" % (fact, bindings))
-                    fact = subst(fact, bindings)
+                        raise ProofError(Diagnostic("Z justification requires fully instantiated fact. Fact %s under bindings %s has uninstantiated pattern variables", fact, bindings))
+                    fact = subst(fact, bindings, fresh_var_name)
+                    if statsCollectors:
+                        check_term_size(fact)
                     antecedent_conjunct = normalize_eq(fact)
                     def checker(conjunct):
                         if follows_in_Z_from(normalize_eq(conjunct), antecedent_conjunct):
@@ -657,7 +1874,10 @@ def check_entailment(line, antecedent, consequent, justification):
             elif justification[0] == 'law':
                 variableBindings, conclusion = get_fact(justification)
                 def checker(conjunct):
-                    if matches(conjunct, conclusion, variableBindings):
+                    trail = []
+                    matched = try_match_all(variableBindings, [(conclusion, conjunct)], trail)
+                    undo_bindings(variableBindings, trail, 0)
+                    if matched:
                         return None
                     else:
                         return ""
@@ -674,85 +1894,1801 @@ def check_entailment(line, antecedent, consequent, justification):
                         if failureInfo2 == None:
                             return None
                         else:
-                            failureInfos = []
-                            if failureInfo1 != "":
-                                failureInfos.append(failureInfo1)
-                            if failureInfo2 != "":
-                                failureInfos.append(failureInfo2)
-                            return "; ".join(failureInfos)
+                            if failureInfo1 == "":
+                                return failureInfo2
+                            elif failureInfo2 == "":
+                                return failureInfo1
+                            return Diagnostic("%s; %s", failureInfo1, failureInfo2)
                 return checker
             else:
-                raise ProofError("Verantwoording niet ondersteund: " + str(justification))
+                raise ProofError(Diagnostic("Verantwoording niet ondersteund: %s", justification))
 
         checker = get_entailment_checker(justification)
         for conjunct in consequent:
             if conjunct not in antecedent:
                 checkerFailureInfo = checker(conjunct)
                 if checkerFailureInfo != None:
-                    raise ProofError("Conjunct niet bewezen: " + str(conjunct) + ("" if checkerFailureInfo == "" else " (" + checkerFailureInfo + ")"))
+                    if checkerFailureInfo == "":
+                        raise ProofError(Diagnostic("Conjunct niet bewezen: %s", conjunct))
+                    raise ProofError(Diagnostic("Conjunct niet bewezen: %s (%s)", conjunct, checkerFailureInfo))
 
     except ProofError as e:
         e.loc = (line, (line[0],-1))
         raise e
 
-def add_law(name, rule):
+def get_symbol(e):
+    if e[0] == 'call':
+        return ('call', e[1], len(e[2]))
+    elif e[0] == 'int':
+        return e
+    else:
+        return e[0]
+
+def get_children(e):
+    if e[0] in binaryOperators:
+        return (e[1], e[2])
+    elif e[0] in unaryOperators:
+        return (e[1],)
+    elif e[0] == 'call':
+        return e[2]
+    else:
+        return ()
+
+class DiscriminationTree:
+    """
+    An index of patterns. A value is stored under the sequence of the symbols of the nodes of its pattern, in preorder,
+    where each pattern variable is 'var'. get_generalizations(term) returns the values stored under the patterns that
+    may match term, taking the symmetric operators into account; the caller must still match them.
+    """
+    def __init__(self):
+        self.root = {}
+
+    def copy(self):
+        def copy_node(node):
+            return dict((symbol, list(child) if symbol is None else copy_node(child)) for symbol, child in node.items())
+        tree = DiscriminationTree()
+        tree.root = copy_node(self.root)
+        return tree
+
+    def get_leaf(self, pattern):
+        node = self.root
+        patterns = [pattern]
+        while patterns != []:
+            e = patterns.pop()
+            node = node.setdefault(get_symbol(e), {})
+            patterns.extend(reversed(get_children(e)))
+        return node.setdefault(None, [])
+
+    def insert(self, pattern, value):
+        self.get_leaf(pattern).append(value)
+
+    def remove(self, pattern, value):
+        self.get_leaf(pattern).remove(value)
+
+    def get_generalizations(self, term):
+        values = []
+
+        def walk(node, terms):
+            if terms == ():
+                values.extend(node.get(None, ()))
+                return
+            t, rest = terms[0], terms[1:]
+            if 'var' in node:
+                walk(node['var'], rest)
+            if t[0] == 'var':
+                return
+            child = node.get(get_symbol(t))
+            if child is not None:
+                walk(child, get_children(t) + rest)
+                if t[0] in symmetricBinaryOperators and t[1] != t[2]:
+                    walk(child, (t[2], t[1]) + rest)
+
+        walk(self.root, (term,))
+        return list(dict.fromkeys(values))
+
+class LawTable(dict):
+    """
+    A table of laws, mapping law names to (premisses, conclusion) pairs, with a DiscriminationTree index over the
+    premisses, the conclusions and the sides of equational conclusions. The index values are (name, role) pairs, where
+    role is 'conclusion', 'lhs', 'rhs' or the index of a premiss. The same patterns are compiled into matchers (see
+    get_compiled_matcher) when a law is added. Copies share the index until one of them changes. A pickled table is
+    rebuilt from its laws, so that the patterns are compiled again on the other side.
+    """
+    def __init__(self, laws=None):
+        dict.__init__(self)
+        self.index = DiscriminationTree()
+        self.indexShared = False
+        if laws is not None:
+            for name, law in laws.items():
+                self[name] = law
+
+    def copy(self):
+        laws = LawTable()
+        dict.update(laws, self)
+        laws.index = self.index
+        laws.indexShared = self.indexShared = True
+        return laws
+
+    def __reduce__(self):
+        return LawTable, (dict(self),)
+
+    def get_index_entries(self, name, law):
+        premisses, conclusion = law
+        entries = [(premiss, (name, i)) for i, premiss in enumerate(premisses)]
+        entries.append((conclusion, (name, 'conclusion')))
+        if conclusion[0] == '==':
+            entries.append((conclusion[1], (name, 'lhs')))
+            entries.append((conclusion[2], (name, 'rhs')))
+        return entries
+
+    def __setitem__(self, name, law):
+        if self.indexShared:
+            self.index = self.index.copy()
+            self.indexShared = False
+        if name in self:
+            for pattern, value in self.get_index_entries(name, self[name]):
+                self.index.remove(pattern, value)
+        dict.__setitem__(self, name, law)
+        for pattern, value in self.get_index_entries(name, law):
+            self.index.insert(pattern, value)
+            get_compiled_matcher(pattern)
+
+    def get_candidates(self, term, roles):
+        """Returns the (name, role) pairs, with role in roles, of the patterns that may match term."""
+        return [(name, role) for name, role in self.index.get_generalizations(term) if role in roles]
+
+def add_law(laws, name, rule):
+    """Adds the law to laws; if laws is a LawTable, this also adds the law to its index."""
     conclusion = rule
     premisses = []
     while conclusion[0] == '==>':
         premisses.extend(get_conjuncts(conclusion[1]))
         conclusion = conclusion[2]
-    laws[name] = (premisses, conclusion)
+    laws[name] = (tuple(premisses), conclusion)
+
+class LawLibraryError(Exception):
+    pass
+
+lawLibraryMagic = b'PCWETTEN'
+lawLibraryFormat = 1
+# The magic number, the format version and the SHA-256 digest of the payload
+lawLibraryHeader = struct.Struct('>8sH32s')
+
+def parse_law_library(text, path='<text>'):
+    """Returns a LawTable of the laws declared in text, which must consist of law declarations and blank lines only."""
+    laws = LawTable()
+    parser = Parser(text)
+    try:
+        while parser.tokenType != 'EOF':
+            if parser.tokenType == 'EOL':
+                parser.eat()
+            else:
+                name, rule = parser.parseLaw()
+                add_law(laws, name, rule)
+    except LocError as e:
+        raise LawLibraryError("Fout in de wettenbibliotheek %s: %s" % (path, e))
+    return laws
+
+def encode_term(nodes, indices, e):
+    """
+    Appends the JSON encodings of the subterms of e that are not in indices yet to nodes, children first, records
+    their positions in indices, and returns the position of e. A node refers to its children by position.
+    """
+    stack = [e]
+    while stack != []:
+        t = stack[-1]
+        if t in indices:
+            stack.pop()
+            continue
+        children = [child for child in get_children(t) if child not in indices]
+        if children != []:
+            stack.extend(children)
+            continue
+        stack.pop()
+        if t[0] in ('var', 'int'):
+            node = list(t)
+        elif t[0] == 'call':
+            node = ['call', t[1]] + [indices[child] for child in t[2]]
+        else:
+            node = [t[0]] + [indices[child] for child in t[1:]]
+        indices[t] = len(nodes)
+        nodes.append(node)
+    return indices[e]
+
+def compile_law_library(laws):
+    """
+    Returns the compiled form of a LawTable: a header (see lawLibraryHeader) followed by the zlib-compressed JSON
+    encoding of the laws and their index, in which the terms form a table of nodes that refer to their children by
+    index, so that shared subterms are stored once.
+    """
+    nodes = []
+    indices = {}
+
+    def encode(e):
+        return encode_term(nodes, indices, e)
 
-def checkProof(proof):
+    def encode_index(node):
+        entries = []
+        for symbol, child in node.items():
+            if symbol is None:
+                entries.append([None, [list(value) for value in child]])
+            else:
+                entries.append([encode(symbol) if type(symbol) is Term else symbol, encode_index(child)])
+        return entries
+
+    encodedLaws = [[name, [encode(premiss) for premiss in premisses], encode(conclusion)] for name, (premisses, conclusion) in laws.items()]
+    encodedIndex = encode_index(laws.index.root)
+    payload = zlib.compress(json.dumps({'nodes': nodes, 'laws': encodedLaws, 'index': encodedIndex}, separators=(',', ':')).encode(), 9)
+    return lawLibraryHeader.pack(lawLibraryMagic, lawLibraryFormat, hashlib.sha256(payload).digest()) + payload
+
+def decode_law_library(data, path='<data>'):
+    """Returns a LawTable of the laws in data, the output of compile_law_library, after checking its integrity."""
+    if len(data) < lawLibraryHeader.size:
+        raise LawLibraryError("Ongeldige gecompileerde wettenbibliotheek %s" % path)
+    magic, formatVersion, digest = lawLibraryHeader.unpack_from(data)
+    payload = data[lawLibraryHeader.size:]
+    if magic != lawLibraryMagic:
+        raise LawLibraryError("Ongeldige gecompileerde wettenbibliotheek %s" % path)
+    if formatVersion != lawLibraryFormat:
+        raise LawLibraryError("De wettenbibliotheek %s werd gecompileerd voor een andere versie van de proof checker; compileer ze opnieuw" % path)
+    if hashlib.sha256(payload).digest() != digest:
+        raise LawLibraryError("De gecompileerde wettenbibliotheek %s is beschadigd" % path)
+    try:
+        d = json.loads(zlib.decompress(payload))
+        terms = []
+
+        def get_term(i):
+            if type(i) is not int or not 0 <= i < len(terms):
+                raise ValueError("bad node index")
+            return terms[i]
+
+        # Each node refers only to earlier nodes, so the terms are built in order
+        for node in d['nodes']:
+            kind = node[0]
+            if kind == 'var' and len(node) == 2 and type(node[1]) is str:
+                terms.append(mk_term('var', node[1]))
+            elif kind == 'int' and len(node) == 2 and type(node[1]) is int:
+                terms.append(mk_term('int', node[1]))
+            elif kind in nullaryOperators and len(node) == 1:
+                terms.append(mk_term(kind))
+            elif kind in unaryOperators and len(node) == 2:
+                terms.append(mk_term(kind, get_term(node[1])))
+            elif kind in binaryOperators and len(node) == 3:
+                terms.append(mk_term(kind, get_term(node[1]), get_term(node[2])))
+            elif kind == 'call' and len(node) >= 2 and type(node[1]) is str:
+                terms.append(mk_term('call', node[1], tuple(get_term(i) for i in node[2:])))
+            else:
+                raise ValueError("bad node")
+        lawItems = {}
+        for name, premisses, conclusion in d['laws']:
+            if type(name) is not str:
+                raise ValueError("bad law name")
+            lawItems[name] = (tuple(get_term(i) for i in premisses), get_term(conclusion))
+
+        def decode_index(entries):
+            node = {}
+            for symbol, child in entries:
+                if symbol is None:
+                    node[None] = [(name, role) for name, role in child if name in lawItems and (role in ('conclusion', 'lhs', 'rhs') or type(role) is int)]
+                elif type(symbol) is int:
+                    node[get_term(symbol)] = decode_index(child)
+                elif type(symbol) is list:
+                    node[tuple(symbol)] = decode_index(child)
+                else:
+                    node[symbol] = decode_index(child)
+            return node
+
+        # The index is stored rather than rebuilt, since building it takes most of the time of adding the laws
+        laws = LawTable()
+        dict.update(laws, lawItems)
+        laws.index.root = decode_index(d['index'])
+        for name, law in lawItems.items():
+            for pattern, _ in laws.get_index_entries(name, law):
+                get_compiled_matcher(pattern)
+    except (ValueError, TypeError, KeyError, IndexError, zlib.error):
+        raise LawLibraryError("Ongeldige gecompileerde wettenbibliotheek %s" % path)
+    return laws
+
+# The law libraries loaded by this process, by absolute path: (modification time and size, LawTable) pairs. Libraries
+# loaded before worker processes are forked are shared with them.
+lawLibraries = {}
+
+def load_law_library(path):
+    """
+    Returns the LawTable of the law library at path: a file of law declarations, or its compiled form (see
+    compile_law_library). The table is cached until the file changes; it must not be modified.
+    """
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = lawLibraries.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise LawLibraryError("Kan de wettenbibliotheek %s niet lezen: %s" % (path, e.strerror))
+    if data.startswith(lawLibraryMagic):
+        laws = decode_law_library(data, path)
+    else:
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            raise LawLibraryError("De wettenbibliotheek %s is geen UTF-8-tekst" % path)
+        laws = parse_law_library(text, path)
+    lawLibraries[path] = (signature, laws)
+    return laws
+
+lawLibraryPattern = re.compile(r'# *Wetten *: *([^\n]*?) *(?:\n|$)')
+
+def preload_law_libraries(paths):
+    """
+    Loads the law libraries referenced by the outline files at paths, e.g. in a parent process before it forks its
+    workers. Files and libraries that cannot be read are skipped; the workers report them.
+    """
+    for path in paths:
+        try:
+            with open(path) as f:
+                for lineText in f:
+                    match = lawLibraryPattern.match(lineText)
+                    if match is not None:
+                        load_law_library(os.path.join(os.path.dirname(path), match.group(1)))
+        except (OSError, UnicodeDecodeError, LawLibraryError):
+            pass
+
+def get_subterms(e):
+    subterms = {}
+    es = [e]
+    while es != []:
+        e = es.pop()
+        if e not in subterms:
+            subterms[e] = None
+            es.extend(get_children(e))
+    return list(subterms)
+
+def infer_justification(laws, antecedent, consequent, budget=200, fresh_var_name=get_fresh_var_name):
+    """
+    Searches for a justification for the step from antecedent to consequent and returns it, or None if none is found
+    after trying budget candidate justifications for single conjuncts. The candidates are, in this order: Z, Z op i,
+    applications to antecedent conjuncts of the laws whose conclusion may match the conjunct, Herschrijven met i in j,
+    Herschrijven met applications of the laws one of whose sides may match a subterm of conjunct j or of the conjunct,
+    and Z op applications of the laws one of whose premisses may match an antecedent conjunct. The laws are looked up
+    in the index of a LawTable. A justification for several conjuncts combines the ones found for each of them with
+    'of'.
+    """
+    if not isinstance(laws, LawTable):
+        laws = LawTable(laws)
+    if not isinstance(antecedent, Antecedent):
+        antecedent = Antecedent(antecedent)
+    indices = range(1, len(antecedent) + 1)
+    tried = 0
+
+    def proves(justification, conjunct):
+        nonlocal tried
+        tried += 1
+        if statsCollectors:
+            count('inference_candidates')
+        try:
+            check_entailment(laws, (0, 0), antecedent, [conjunct], justification, fresh_var_name)
+            return True
+        except ProofError:
+            return False
+
+    def get_applications(name, premissIndices):
+        """Generates the applications of the law to antecedent conjuncts that may match its premisses."""
+        premisses = laws[name][0]
+        if premissIndices is None:
+            premissIndices = [[i for i in antecedent.get_candidate_indices(premiss) if try_match({}, premiss, antecedent[i - 1], [])] for premiss in premisses]
+        for args in itertools.product(*premissIndices):
+            yield ('law', name, tuple(('antecedent', i) for i in args))
+
+    forwardPremissIndices = None
+
+    def get_forward_facts():
+        """Generates the applications of laws with premisses that may match antecedent conjuncts."""
+        nonlocal forwardPremissIndices
+        if forwardPremissIndices is None:
+            forwardPremissIndices = {}
+            for i in indices:
+                for name, role in laws.index.get_generalizations(antecedent[i - 1]):
+                    if isinstance(role, int):
+                        forwardPremissIndices.setdefault(name, [[] for _ in laws[name][0]])[role].append(i)
+        for name, candidates in forwardPremissIndices.items():
+            if all(candidates):
+                yield from get_applications(name, candidates)
+
+    def get_candidates(conjunct):
+        yield ('Z', None)
+        for i in indices:
+            yield ('Z', ('antecedent', i))
+        for name, _ in laws.get_candidates(conjunct, ('conclusion',)):
+            yield from get_applications(name, None)
+        for i in antecedent.get_indices_with_head('=='):
+            for j in indices:
+                if j != i:
+                    yield ('Herschrijven', ('antecedent', i), j)
+        for j in indices:
+            names = {}
+            for subterm in get_subterms(antecedent[j - 1]) + get_subterms(conjunct):
+                for name, _ in laws.get_candidates(subterm, ('lhs', 'rhs')):
+                    names[name] = None
+            for name in names:
+                for fact in get_applications(name, None):
+                    yield ('Herschrijven', fact, j)
+        for fact in get_forward_facts():
+            yield ('Z', fact)
+
+    found = []
+    for conjunct in consequent:
+        if conjunct in antecedent or any(proves(justification, conjunct) for justification in found):
+            continue
+        for justification in get_candidates(conjunct):
+            if tried >= budget:
+                return None
+            if proves(justification, conjunct):
+                found.append(justification)
+                break
+        else:
+            return None
+    if found == []:
+        return None
+    justification = found[-1]
+    for j in reversed(found[:-1]):
+        justification = ('of', j, justification)
+    return justification
+
+def fact_spec_to_text(factSpec, nested=False):
+    if factSpec[0] == 'antecedent':
+        return str(factSpec[1])
+    _, lawName, arguments = factSpec
+    if arguments == ():
+        return lawName
+    text = lawName + ' op ' + ' en '.join(fact_spec_to_text(argument, True) for argument in arguments)
+    return '(' + text + ')' if nested else text
+
+def justification_to_text(justification):
+    """Returns the justification as it would be written after the '#' of an assert line."""
+    if justification[0] == 'Herschrijven':
+        return 'Herschrijven met %s in %d' % (fact_spec_to_text(justification[1]), justification[2])
+    elif justification[0] == 'Z':
+        return 'Z' if justification[1] is None else 'Z op ' + fact_spec_to_text(justification[1])
+    elif justification[0] == 'of':
+        return justification_to_text(justification[1]) + ' of ' + justification_to_text(justification[2])
+    else:
+        return fact_spec_to_text(justification)
+
+def checkProof(laws, proof, fresh_var_name=get_fresh_var_name):
     if proof == []:
         raise ProofError("Need at least one assert")
-    antecedent = get_conjuncts(proof[0][1])
+    antecedent = Antecedent(get_conjuncts(proof[0][1]))
     i = 1
     while i < len(proof):
         line, consequent, justification = proof[i]
-        consequent = get_conjuncts(consequent)
+        consequent = Antecedent(get_conjuncts(consequent))
 
-        check_entailment(line, antecedent, consequent, justification)
+        check_entailment(laws, line, antecedent, consequent, justification, fresh_var_name)
 
         antecedent = consequent
         i += 1
 
-def check_text(text):
-    # lexer = Lexer(text)
-    # while True:
-    #     token = lexer.next_token()
-    #     print("'%s': '%s'" % (token, lexer.get_token_value()))
-    #     if token == 'EOF':
-    #         break
+def error_to_dict(e):
+    (startLine, startCol), (endLine, endCol) = e.loc
+    return {
+        'kind': type(e).__name__,
+        'line': startLine + 1,
+        'column': startCol,
+        'endLine': endLine + 1,
+        'endColumn': endCol,
+        'message': e.message
+    }
+
+class StepResult:
+    """
+    The verdict on the step that ends at line: 'valid', 'invalid', 'skipped' or 'limit'. If a justification was
+    inferred, justification is its text.
+    """
+    def __init__(self, line, status, error=None, justification=None):
+        self.line = line
+        self.status = status
+        self.error = error
+        self.justification = justification
+
+    def shifted(self, lines):
+        return StepResult(self.line + lines, self.status, None if self.error is None else shift_error(self.error, lines), self.justification)
+
+    def to_dict(self):
+        d = {'line': self.line + 1, 'status': self.status, 'message': None if self.error is None else self.error.message}
+        if self.justification is not None:
+            d['justification'] = self.justification
+        return d
+
+def shift_error(e, lines):
+    """Returns a copy of e with its location moved down by the given number of lines."""
+    if lines == 0:
+        return e
+    (startLine, startCol), (endLine, endCol) = e.loc
+    return type(e).at(((startLine + lines, startCol), (endLine + lines, endCol)), e.args[0])
 
-    parser = Parser(text)
-    while parser.tokenType != 'EOF':
-        if parser.tokenType == 'EOL':
-            parser.eat()
-        elif parser.tokenType == '#':
-            name, rule = parser.parseLaw()
-            # print("Adding law", name, rule)
-            add_law(name, rule)
+class CheckResult:
+    """
+    The outcome of checking a proof outline: the laws it declares, the number of proofs checked, the verdicts on the
+    steps checked and the errors, in order. If statistics were collected, stats is the list of the statistics of the
+    steps checked (see StepStats), each with the line of the step.
+    """
+    def __init__(self):
+        self.laws = []
+        self.proofs = 0
+        self.steps = []
+        self.errors = []
+        self.stats = None
+
+    def is_valid(self):
+        return self.errors == []
+
+    def has_limit_errors(self, only=False):
+        """Returns whether some (or, if only is set, all) of the errors are ResourceLimitExceeded errors."""
+        isLimitError = [isinstance(e, ResourceLimitExceeded) for e in self.errors]
+        return all(isLimitError) if only else any(isLimitError)
+
+    def add(self, other, lines=0):
+        """Adds the proofs, steps and errors of other, moved down by the given number of lines, to this result."""
+        self.proofs += other.proofs
+        self.steps.extend(step.shifted(lines) for step in other.steps)
+        self.errors.extend(shift_error(e, lines) for e in other.errors)
+
+    def get_stats_totals(self):
+        totals = dict.fromkeys(['steps', 'time'] + statNames, 0)
+        for stepStats in self.stats:
+            totals['steps'] += 1
+            for name in ['time'] + statNames:
+                totals[name] += stepStats[name]
+        return totals
+
+    def to_dict(self):
+        d = {
+            'valid': self.is_valid(),
+            'laws': self.laws,
+            'proofs': self.proofs,
+            'steps': [step.to_dict() for step in self.steps],
+            'errors': [error_to_dict(e) for e in self.errors]
+        }
+        if self.stats is not None:
+            d['stats'] = {'steps': self.stats, 'totals': self.get_stats_totals()}
+        return d
+
+def get_referenced_laws(justification):
+    """Returns the set of names of the laws referenced by a justification or fact specification."""
+    if justification is None:
+        return set()
+    elif justification[0] == 'law':
+        return {justification[1]}.union(*map(get_referenced_laws, justification[2]))
+    elif justification[0] in ('Herschrijven', 'Z'):
+        return get_referenced_laws(justification[1])
+    elif justification[0] == 'of':
+        return get_referenced_laws(justification[1]) | get_referenced_laws(justification[2])
+    else:
+        return set()
+
+def get_step_key(laws, antecedent, consequent, justification):
+    """
+    Returns a key that determines the verdict on a step: its antecedent and consequent conjuncts, its justification and
+    the laws referenced by it, as they are in laws.
+    """
+    lawDeps = tuple((name, laws.get(name)) for name in sorted(get_referenced_laws(justification)))
+    return (tuple(antecedent), tuple(consequent), justification, lawDeps)
+
+def get_step_key_text(key):
+    """Returns a JSON text that determines a step key, for storing its verdict outside this process."""
+    antecedent, consequent, justification, lawDeps = key
+    nodes = []
+    indices = {}
+
+    def encode(e):
+        return encode_term(nodes, indices, e)
+
+    encodedLawDeps = [[name, None if law is None else [list(map(encode, law[0])), encode(law[1])]] for name, law in lawDeps]
+    step = [list(map(encode, antecedent)), list(map(encode, consequent)), repr(justification), encodedLawDeps]
+    return json.dumps([nodes, step], separators=(',', ':'))
+
+errorKinds = {'LocError': LocError, 'ParseError': ParseError, 'ProofError': ProofError, 'MatchFailure': MatchFailure, 'ResourceLimitExceeded': ResourceLimitExceeded}
+
+def error_from_dict(d):
+    """The inverse of error_to_dict."""
+    return errorKinds[d['kind']].at(((d['line'] - 1, d['column']), (d['endLine'] - 1, d['endColumn'])), d['message'])
+
+class ResultCache:
+    """
+    A persistent store, in the SQLite database at path, of the results of checking proof blocks. A result is stored
+    under a hash of the text of the block, the laws visible to it, the check_all flag and the source code of this
+    checker, so that any change to one of these yields a different key. The store can be shared by several processes.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(__file__, 'rb') as f:
+            self.checkerDigest = hashlib.sha256(f.read()).digest()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS blocks (key TEXT PRIMARY KEY, result TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS steps (key TEXT PRIMARY KEY, error TEXT)')
+        self.connection.commit()
+        self.lastLaws = None
+        self.lastLawsDigest = None
+        # The step verdicts not yet written, by digest; see flush_steps
+        self.pendingSteps = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_laws_digest(self, laws):
+        lawItems = tuple(sorted(laws.items()))
+        if lawItems != self.lastLaws:
+            self.lastLaws = lawItems
+            self.lastLawsDigest = hashlib.sha256(repr(lawItems).encode()).digest()
+        return self.lastLawsDigest
+
+    def get_key(self, laws, lines, check_all, infer=False):
+        h = hashlib.sha256(self.checkerDigest)
+        with self.lock:
+            h.update(self.get_laws_digest(laws))
+        h.update(repr((check_all, infer, tuple(lines))).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns the CheckResult and the referenced law names stored under key, or None."""
+        with self.lock:
+            row = self.connection.execute('SELECT result FROM blocks WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        d = json.loads(row[0])
+        result = CheckResult()
+        result.proofs = d['proofs']
+        result.errors = [error_from_dict(error) for error in d['errors']]
+        result.steps = [StepResult(line, status, None if i is None else result.errors[i], justification) for line, status, i, justification in d['steps']]
+        return result, set(d['lawNames'])
+
+    def put(self, key, result, lawNames):
+        d = {
+            'proofs': result.proofs,
+            'steps': [[step.line, step.status, None if step.error is None else result.errors.index(step.error), step.justification] for step in result.steps],
+            'errors': [error_to_dict(e) for e in result.errors],
+            'lawNames': sorted(lawNames)
+        }
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO blocks (key, result) VALUES (?, ?)', (key, json.dumps(d)))
+            self.connection.commit()
+
+    def get_step_digest(self, key):
+        """Returns the key under which the verdict on the step with the given step key (see get_step_key) is stored."""
+        h = hashlib.sha256(self.checkerDigest)
+        h.update(get_step_key_text(key).encode())
+        return h.hexdigest()
+
+    def get_step(self, digest):
+        """
+        Returns the verdict on a step stored under digest: None if the step is valid, otherwise a (kind, message)
+        pair for its ProofError; or missing if no verdict is stored.
+        """
+        with self.lock:
+            if digest in self.pendingSteps:
+                text = self.pendingSteps[digest]
+            else:
+                row = self.connection.execute('SELECT error FROM steps WHERE key = ?', (digest,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return missing
+                text = row[0]
+            self.hits += 1
+        return None if text is None else tuple(json.loads(text))
+
+    def put_step(self, digest, error):
+        """Stores the verdict on a step (None or its ProofError) under digest; it is written by the next flush_steps."""
+        with self.lock:
+            self.pendingSteps[digest] = None if error is None else json.dumps([type(error).__name__, error.message])
+
+    def flush_steps(self):
+        """Writes the pending step verdicts in one transaction, rather than one per step."""
+        with self.lock:
+            if self.pendingSteps:
+                self.connection.executemany('INSERT OR REPLACE INTO steps (key, error) VALUES (?, ?)', self.pendingSteps.items())
+                self.connection.commit()
+                self.pendingSteps = {}
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM blocks')
+            self.connection.execute('DELETE FROM steps')
+            self.connection.commit()
+
+    def close(self):
+        self.flush_steps()
+        with self.lock:
+            self.connection.close()
+
+class Checker:
+    """
+    Checks proof outlines against a LawTable of laws, optionally caching results in a ResultCache. Laws declared or
+    referenced in an outline are visible only in the rest of it. See infer_justification for infer, StepStats for
+    stats, Limits for limits and check_proof_steps for jobs; close shuts down the pool of workers.
+    """
+    maxInternedTerms = 1 << 20
+    stepChunkSize = 32
+
+    def __init__(self, laws=None, cache=None, infer=False, inferBudget=200, stats=False, limits=None, jobs=None):
+        # A LawTable, e.g. a loaded law library, is copied with its index
+        self.laws = laws.copy() if isinstance(laws, LawTable) else LawTable(laws)
+        self.cache = cache
+        self.infer = infer
+        self.inferBudget = inferBudget
+        self.stats = stats
+        self.statsCallback = None
+        self.collectedStats = None
+        self.blockLine = 0
+        self.limits = limits
+        self.budget = None
+        self.jobs = jobs
+        self.stepExecutor = None
+        self.baseDir = None
+        self.allowLibraries = True
+
+    def add_law(self, name, rule):
+        add_law(self.laws, name, rule)
+        # The workers got the previous law table
+        self.close()
+
+    def close(self):
+        if self.stepExecutor is not None:
+            self.stepExecutor.shutdown()
+            self.stepExecutor = None
+
+    def add_laws_from_text(self, text):
+        """Adds the laws declared in text, which must consist of law declarations only, to this checker's law table."""
+        parser = Parser(text)
+        while parser.tokenType != 'EOF':
+            if parser.tokenType == 'EOL':
+                parser.eat()
+            else:
+                name, rule = parser.parseLaw()
+                self.add_law(name, rule)
+
+    def add_outline_laws(self, laws, item, lineNo):
+        """
+        Adds the laws of a law declaration or a law library reference, parsed from line lineNo of an outline, to laws
+        and returns their names. A relative library path is taken relative to baseDir. Library references are an
+        error if allowLibraries is not set, e.g. for outlines that come from untrusted clients.
+        """
+        if item[0] == 'library':
+            if not self.allowLibraries:
+                raise ProofError.at(((lineNo, 0), (lineNo, -1)), "Verwijzingen naar wettenbibliotheken zijn hier niet toegestaan")
+            try:
+                library = load_law_library(os.path.join(self.baseDir or '', item[1]))
+            except LawLibraryError as e:
+                raise ProofError.at(((lineNo, 0), (lineNo, -1)), e.args[0])
+            for name, law in library.items():
+                laws[name] = law
+            return list(library)
+        _, name, rule = item
+        add_law(laws, name, rule)
+        return [name]
+
+    def parse_outline_line(self, lineText, lineNo):
+        return Parser(lineText, lineNo).parseOutlineLine()
+
+    def check_step(self, laws, line, antecedent, consequent, justification):
+        """
+        Checks a step, or looks up its verdict in stepVerdictCache and then in the ResultCache, if any: the same step,
+        e.g. in another outline, need not be checked again.
+        """
+        key = get_step_key(laws, antecedent, consequent, justification)
+        error = stepVerdictCache.get(key, missing)
+        digest = None
+        if error is missing and self.cache is not None:
+            digest = self.cache.get_step_digest(key)
+            storedError = self.cache.get_step(digest)
+            if storedError is not missing:
+                error = None if storedError is None else errorKinds[storedError[0]].at((line, (line[0], -1)), storedError[1])
+                stepVerdictCache.put(key, error)
+        if error is missing:
+            # Fresh variables are numbered per step, so that the verdict and the message for a step do not depend on
+            # which steps were checked before it
+            freshVarCounter = itertools.count()
+            try:
+                check_entailment(laws, line, antecedent, consequent, justification, lambda: "#x%d" % next(freshVarCounter))
+                error = None
+            except ProofError as e:
+                error = e
+            stepVerdictCache.put(key, error)
+            if digest is not None:
+                self.cache.put_step(digest, error)
+        if error is not None:
+            raise type(error).at((line, (line[0], -1)), error.args[0])
+
+    def infer_justification(self, laws, antecedent, consequent):
+        freshVarCounter = itertools.count()
+        return infer_justification(laws, antecedent, consequent, self.inferBudget, lambda: "#x%d" % next(freshVarCounter))
+
+    def check_block(self, laws, lines, check_all):
+        """
+        Checks a proof block, given as a list of assert lines, as if it started at the first line of the file.
+        Returns a CheckResult and the set of names of the laws referenced by the block. An assert line that cannot be
+        parsed breaks the chain: the step that follows it is skipped.
+        """
+        if self.cache is None:
+            return self.check_block_uncached(laws, lines, check_all)
+        key = self.cache.get_key(laws, lines, check_all, self.infer)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result, lawNames = self.check_block_uncached(laws, lines, check_all)
+        self.cache.flush_steps()
+        # Whether a limit is exceeded depends on the machine and the load
+        if not result.has_limit_errors():
+            self.cache.put(key, result, lawNames)
+        return result, lawNames
+
+    def check_block_uncached(self, laws, lines, check_all):
+        result = CheckResult()
+        lawNames = set()
+        block = []
+        for lineNo, lineText in enumerate(lines):
+            try:
+                block.append(self.parse_outline_line(lineText, lineNo)[1])
+            except ParseError as e:
+                block.append(e)
+        parseErrors = [item for item in block if isinstance(item, ParseError)]
+        if parseErrors != []:
+            if not check_all:
+                result.errors.append(parseErrors[0])
+                return result, lawNames
+            result.errors.extend(parseErrors)
+        if len(block) > len(parseErrors):
+            result.proofs += 1
+        steps = []
+        antecedent = None
+        for item in block:
+            if isinstance(item, ParseError):
+                antecedent = 'unknown'
+                continue
+            line, e, justification = item
+            consequent = Antecedent(get_conjuncts(e))
+            if antecedent == 'unknown':
+                steps.append(StepResult(line[0], 'skipped'))
+            elif antecedent is not None:
+                steps.append((line, antecedent, consequent, justification))
+            antecedent = consequent
+        for step in self.check_proof_steps(laws, steps, lawNames):
+            result.steps.append(step)
+            if step.error is not None:
+                result.errors.append(step.error)
+                if step.status == 'invalid' and not check_all:
+                    break
+        return result, lawNames
+
+    def check_proof_steps(self, laws, steps, lawNames):
+        """
+        Checks the steps of a proof block, given as (line, antecedent, consequent, justification) tuples or, for steps
+        that are skipped, as StepResults, and generates their StepResults in order; see check_proof_step. The caller
+        may stop at any step. If jobs is set and limits is not, and there are more than stepChunkSize steps, the steps
+        are checked in parallel, in chunks of consecutive steps, in a pool of worker processes that got the checker's
+        law table when the pool was started; only the laws declared in the outline are sent with each chunk. The
+        results, and the statistics collected, are then the same as if the steps were checked one by one.
+        """
+        if self.jobs is None or self.limits is not None or len(steps) <= self.stepChunkSize:
+            for step in steps:
+                if isinstance(step, StepResult):
+                    yield step
+                else:
+                    yield self.check_proof_step(laws, *step, lawNames)
+            return
+        if self.stepExecutor is None:
+            self.stepExecutor = ProcessPoolExecutor(self.jobs, initializer=init_step_worker, initargs=(self.laws, self.infer, self.inferBudget, self.stats))
+        outlineLaws = dict((name, law) for name, law in laws.items() if self.laws.get(name) != law)
+        checked = [step for step in steps if not isinstance(step, StepResult)]
+        futures = []
+        for i in range(0, len(checked), self.stepChunkSize):
+            # Pickling a chunk sends the consequent of a step, which is the antecedent of the next one, only once
+            futures.append(self.stepExecutor.submit(check_step_chunk, outlineLaws, checked[i:i + self.stepChunkSize]))
+        results = (result for future in futures for result in future.result())
+        try:
+            for step in steps:
+                if isinstance(step, StepResult):
+                    yield step
+                    continue
+                stepResult, stepLawNames, stats = next(results)
+                lawNames |= stepLawNames
+                if stats is not None:
+                    stats['line'] += self.blockLine
+                    if self.collectedStats is not None:
+                        self.collectedStats.append(stats)
+                    if self.statsCallback is not None:
+                        self.statsCallback(stats)
+                yield stepResult
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def check_proof_step(self, laws, line, antecedent, consequent, justification, lawNames):
+        """
+        Checks the step from antecedent to consequent that ends at line and returns its StepResult. Adds the names of
+        the laws referenced by its justification, which is inferred if it is missing and infer is set, to lawNames.
+        """
+        stepStats = StepStats() if self.stats else contextlib.nullcontext()
+        budget = contextlib.nullcontext() if self.budget is None else self.budget
+        inferred = None
+        try:
+            with stepStats, budget:
+                for conjunct in consequent:
+                    check_term_size(conjunct)
+                if justification is None and self.infer and not all(conjunct in antecedent for conjunct in consequent):
+                    justification = self.infer_justification(laws, antecedent, consequent)
+                    if justification is not None:
+                        inferred = justification_to_text(justification)
+                lawNames |= get_referenced_laws(justification)
+                self.check_step(laws, line, antecedent, consequent, justification)
+            return StepResult(line[0], 'valid', justification=inferred)
+        except ProofError as error:
+            return StepResult(line[0], 'invalid', error)
+        except ResourceLimitExceeded as error:
+            error.loc = (line, (line[0], -1))
+            return StepResult(line[0], 'limit', error)
+        finally:
+            if self.stats:
+                self.add_stats(line[0], stepStats)
+
+    def add_stats(self, line, stepStats):
+        stats = {'line': self.blockLine + line + 1}
+        stats.update(stepStats.to_dict())
+        if self.collectedStats is not None:
+            self.collectedStats.append(stats)
+        if self.statsCallback is not None:
+            self.statsCallback(stats)
+
+    def check_text(self, text, check_all=False):
+        """
+        Checks the laws and proofs in text, in order, and returns a CheckResult. Normally checking stops at the first
+        error. With check_all, every step of every proof is checked, and after a parse error parsing resumes at the
+        next line.
+        """
+        result = CheckResult()
+        if self.stats:
+            result.stats = self.collectedStats = []
+        self.budget = None if self.limits is None else Budget(self.limits)
+        laws = self.laws.copy()
+        with check_in_progress():
+            for kind, lineNo, lines in split_outline(text):
+                if kind == 'block':
+                    self.blockLine = lineNo
+                    blockResult, lawNames = self.check_block(laws, lines, check_all)
+                    result.add(blockResult, lineNo)
+                else:
+                    try:
+                        item = self.parse_outline_line(lines, lineNo)
+                        if item is not None:
+                            result.laws.extend(self.add_outline_laws(laws, item, lineNo))
+                    except LocError as e:
+                        result.errors.append(e)
+                if not check_all and result.errors != [] and not result.has_limit_errors(only=True):
+                    break
+            trim_intern_tables(self.maxInternedTerms)
+        result.errors.sort(key=lambda e: e.loc[0])
+        return result
+
+    def check_file(self, path, check_all=False):
+        """Checks the outline at path; the law libraries it references are looked up relative to its directory."""
+        with open(path) as f:
+            text = f.read()
+        baseDir = self.baseDir
+        self.baseDir = os.path.dirname(path)
+        try:
+            return self.check_text(text, check_all)
+        finally:
+            self.baseDir = baseDir
+
+    def check_lines(self, lines, check_all=False):
+        """
+        Like check_text, but reads an iterable of lines, such as an open file, one line at a time and checks each step
+        as soon as it is read. Generates ('law', lineNo, name), ('step', lineNo, stepResult) and ('error', lineNo,
+        error) triples. Nothing is cached.
+        """
+        with check_in_progress():
+            self.collectedStats = None
+            self.blockLine = 0
+            self.budget = None if self.limits is None else Budget(self.limits)
+            laws = self.laws.copy()
+            antecedent = None
+            for lineNo, lineText in enumerate(lines):
+                if not is_assert_line(lineText):
+                    antecedent = None
+                    try:
+                        item = Parser(lineText, lineNo).parseOutlineLine()
+                        names = [] if item is None else self.add_outline_laws(laws, item, lineNo)
+                    except LocError as error:
+                        yield ('error', lineNo, error)
+                        if not check_all:
+                            return
+                        continue
+                    for name in names:
+                        yield ('law', lineNo, name)
+                    continue
+                try:
+                    line, e, justification = Parser(lineText, lineNo).parseOutlineLine()[1]
+                except ParseError as error:
+                    yield ('error', lineNo, error)
+                    if not check_all:
+                        return
+                    antecedent = 'unknown'
+                    continue
+                consequent = Antecedent(get_conjuncts(e))
+                if antecedent == 'unknown':
+                    yield ('step', lineNo, StepResult(lineNo, 'skipped'))
+                elif antecedent is not None:
+                    step = self.check_proof_step(laws, line, antecedent, consequent, justification, set())
+                    yield ('step', lineNo, step)
+                    if step.status == 'invalid' and not check_all:
+                        return
+                antecedent = consequent
+                trim_intern_tables(self.maxInternedTerms)
+
+class CheckCancelled(Exception):
+    pass
+
+class IncrementalChecker(Checker):
+    """
+    A Checker for checking successive versions of the same outlines, e.g. while they are being edited. The results
+    for lines, for proof blocks and for steps whose text and referenced laws did not change since the previous check
+    are reused, also when they moved to other lines. The results are kept as long as they occur in the last version
+    checked of some document; check_text takes the document, e.g. a file name, as an optional argument. If cancelled
+    is set to a function, it is called between blocks and steps; if it returns True, check_text raises
+    CheckCancelled.
+    """
+    segmentSize = 64
+
+    def __init__(self, laws=None, cache=None, infer=False, stats=False, limits=None):
+        Checker.__init__(self, laws, cache, infer, stats=stats, limits=limits)
+        self.cancelled = None
+        self.lineResults = {}
+        self.blockResults = {}
+        self.stepResults = {}
+        self.usedLines = set()
+        self.usedBlocks = set()
+        self.usedSteps = set()
+        self.blockSteps = set()
+        self.documentKeys = {}
+
+    def check_if_cancelled(self):
+        if self.cancelled is not None and self.cancelled():
+            raise CheckCancelled()
+
+    def parse_outline_line(self, lineText, lineNo):
+        self.usedLines.add(lineText)
+        if lineText in self.lineResults:
+            item = self.lineResults[lineText]
         else:
-            proof = parser.parseProof()
-            # print(proof)
-            checkProof(proof)
+            try:
+                item = Checker.parse_outline_line(self, lineText, 0)
+            except LocError as e:
+                item = e
+            self.lineResults[lineText] = item
+        if isinstance(item, LocError):
+            raise shift_error(item, lineNo)
+        if item is not None and item[0] == 'assert' and lineNo != 0:
+            (line, col), e, justification = item[1]
+            item = ('assert', ((line + lineNo, col), e, justification))
+        return item
+
+    def check_step(self, laws, line, antecedent, consequent, justification):
+        self.check_if_cancelled()
+        key = get_step_key(laws, antecedent, consequent, justification)
+        self.blockSteps.add(key)
+        if key in self.stepResults:
+            error = self.stepResults[key]
+        else:
+            try:
+                Checker.check_step(self, laws, (0, line[1]), antecedent, consequent, justification)
+                error = None
+            except ProofError as e:
+                error = e
+            self.stepResults[key] = error
+        if error is not None:
+            raise shift_error(error, line[0])
+
+    def check_block(self, laws, lines, check_all):
+        """
+        With check_all, a block of more than segmentSize steps is checked as a sequence of segments of segmentSize
+        steps, each starting at the last line of the previous one, and the results are reused per segment, so that an
+        edit invalidates only the results of the segments around it.
+        """
+        if not check_all or len(lines) <= self.segmentSize + 1:
+            return self.check_segment(laws, lines, check_all)
+        result = CheckResult()
+        lawNames = set()
+        for start in range(0, len(lines) - 1, self.segmentSize):
+            segmentResult, segmentLawNames = self.check_segment(laws, lines[start:start + self.segmentSize + 1], check_all)
+            if start > 0 and isinstance(self.lineResults.get(lines[start]), LocError):
+                # The parse error of the first line of the segment was reported with the previous segment; parse
+                # errors come first
+                shared = segmentResult
+                segmentResult = CheckResult()
+                segmentResult.steps = shared.steps
+                segmentResult.errors = shared.errors[1:]
+            proofs = max(result.proofs, segmentResult.proofs)
+            result.add(segmentResult, start)
+            result.proofs = proofs
+            lawNames |= segmentLawNames
+        return result, lawNames
+
+    def check_segment(self, laws, lines, check_all):
+        self.check_if_cancelled()
+        key = (tuple(lines), check_all, self.infer)
+        self.usedBlocks.add(key)
+        self.usedLines.update(lines)
+        if key in self.blockResults:
+            lawDeps, result, lawNames, stepKeys = self.blockResults[key]
+            if all(laws.get(name) == law for name, law in lawDeps):
+                self.usedSteps |= stepKeys
+                return result, lawNames
+        self.blockSteps = set()
+        result, lawNames = Checker.check_block(self, laws, lines, check_all)
+        lawDeps = tuple((name, laws.get(name)) for name in lawNames)
+        if not result.has_limit_errors():
+            self.blockResults[key] = (lawDeps, result, lawNames, self.blockSteps)
+        self.usedSteps |= self.blockSteps
+        return result, lawNames
+
+    def check_text(self, text, check_all=False, document=None):
+        self.usedLines = set()
+        self.usedBlocks = set()
+        self.usedSteps = set()
+        result = Checker.check_text(self, text, check_all)
+        self.documentKeys[document] = (self.usedLines, self.usedBlocks, self.usedSteps)
+        # Pruning takes time linear in the number of results kept; doing it only when they have doubled amortizes it
+        used = sum(len(keys) for documentKeys in self.documentKeys.values() for keys in documentKeys)
+        if len(self.lineResults) + len(self.blockResults) + len(self.stepResults) > 2 * used:
+            self.forget_unused_results()
+        return result
+
+    def close_document(self, document):
+        self.documentKeys.pop(document, None)
+        self.forget_unused_results()
+
+    def forget_unused_results(self):
+        """Forgets the lines, blocks and steps that no longer occur in any document."""
+        usedLines = set().union(*(keys[0] for keys in self.documentKeys.values()))
+        usedBlocks = set().union(*(keys[1] for keys in self.documentKeys.values()))
+        usedSteps = set().union(*(keys[2] for keys in self.documentKeys.values()))
+        self.lineResults = dict((key, value) for key, value in self.lineResults.items() if key in usedLines)
+        self.blockResults = dict((key, value) for key, value in self.blockResults.items() if key in usedBlocks)
+        self.stepResults = dict((key, value) for key, value in self.stepResults.items() if key in usedSteps)
+
+def check_text(text):
+    result = Checker().check_text(text)
+    if result.errors:
+        raise result.errors[0]
 
 def check_file(path):
     with open(path) as f:
         text = f.read()
     check_text(text)
 
-if len(sys.argv) > 1:
+def collect_outline_files(paths):
+    """Returns the given files, and the .py files found recursively in the given directories, in sorted order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirPath, dirNames, fileNames in os.walk(path):
+                dirNames.sort()
+                for fileName in sorted(fileNames):
+                    if fileName.endswith('.py'):
+                        files.append(os.path.join(dirPath, fileName))
+        else:
+            files.append(path)
+    return files
+
+def check_batch_file(checker, path, check_all=False):
+    """
+    Checks one file and returns its JSON-serializable verdict; with check_all, the verdict includes all errors and the
+    verdicts on all steps. If the checker inferred justifications, the verdict lists them; if it collected statistics,
+    the verdict includes them. Unexpected exceptions are reported, not raised.
+    """
+    return get_batch_verdict(checker, path, lambda: checker.check_file(path, check_all), check_all)
+
+def get_batch_verdict(checker, name, check, check_all):
+    """Returns the verdict (see check_batch_file) on the outline called name, which check checks with checker."""
+    start = time.perf_counter()
+    result = None
     try:
-        check_file(sys.argv[1])
-        print("%s was checked successfully; the proof outline is valid!" % (sys.argv[1],))
-    except LocError as e:
-        print(e)
-else:
+        result = check()
+        if result.is_valid():
+            status, line, message = 'valid', None, None
+        else:
+            # A file is only reported as hitting a resource limit if no proof errors were found
+            status = 'limit' if result.has_limit_errors(only=True) else 'invalid'
+            error = error_to_dict([e for e in result.errors if status == 'limit' or not isinstance(e, ResourceLimitExceeded)][0])
+            line, message = error['line'], error['message']
+    except Exception as e:
+        status, line, message = 'crash', None, '%s: %s' % (type(e).__name__, e)
+    verdict = {'file': name, 'status': status, 'line': line, 'message': message, 'time': time.perf_counter() - start}
+    if check_all and result is not None:
+        resultDict = result.to_dict()
+        verdict['errors'] = resultDict['errors']
+        verdict['steps'] = resultDict['steps']
+    if result is not None and checker.infer:
+        verdict['justifications'] = [{'line': step.line + 1, 'justification': step.justification} for step in result.steps if step.justification is not None]
+    if result is not None and result.stats is not None:
+        verdict['stats'] = result.to_dict()['stats']
+    return verdict
+
+batchChecker = None
+
+batchCheckAll = False
+
+# A queue to which the worker puts the number of each chunk it starts checking, so that when a worker dies, the chunks
+# it may have been checking are known
+batchStartedChunks = None
+
+def init_batch_worker(laws=None, check_all=False, cachePath=None, infer=False, stats=False, limits=None, allowLibraries=True, startedChunks=None):
+    global batchChecker, batchCheckAll, batchStartedChunks
+
+    batchCheckAll = check_all
+    batchStartedChunks = startedChunks
+    batchChecker = Checker(laws, cache=None if cachePath is None else ResultCache(cachePath), infer=infer, stats=stats, limits=limits)
+    batchChecker.allowLibraries = allowLibraries
+
+def check_batch_files(paths, chunk=None):
+    if chunk is not None:
+        batchStartedChunks.put(chunk)
+    return [check_batch_file(batchChecker, path, batchCheckAll) for path in paths]
+
+stepChecker = None
+
+def init_step_worker(laws, infer, inferBudget, stats):
+    global stepChecker
+
+    stepChecker = Checker(laws, infer=infer, inferBudget=inferBudget, stats=stats)
+
+def check_step_chunk(outlineLaws, chunk):
+    """
+    Checks a chunk of steps of a proof block with stepChecker, whose law table is extended with outlineLaws, and
+    returns a (StepResult, lawNames, stats) triple for each step.
+    """
+    laws = stepChecker.laws
+    if outlineLaws:
+        laws = laws.copy()
+        for name, law in outlineLaws.items():
+            laws[name] = law
+    results = []
+    with check_in_progress():
+        for line, antecedent, consequent, justification in chunk:
+            lawNames = set()
+            stepChecker.collectedStats = [] if stepChecker.stats else None
+            step = stepChecker.check_proof_step(laws, line, antecedent, consequent, justification, lawNames)
+            results.append((step, lawNames, stepChecker.collectedStats[0] if stepChecker.stats else None))
+        trim_intern_tables(stepChecker.maxInternedTerms)
+    return results
+
+def run_batch(paths, output, laws=None, jobs=None, chunkSize=8, check_all=False, cachePath=None, infer=False, stats=False, limits=None):
+    """
+    Checks the given outline files in a pool of jobs worker processes, chunkSize files at a time, and writes one JSON
+    line per file to output. If a worker dies, only the files it was checking are checked again, one per process.
+    Returns the list of verdicts.
+    """
+    verdicts = []
+
+    def emit(verdict):
+        verdicts.append(verdict)
+        output.write(json.dumps(verdict) + '\n')
+        output.flush()
+
+    files = collect_outline_files(paths)
+    preload_law_libraries(files)
+    chunks = [files[i:i + chunkSize] for i in range(0, len(files), chunkSize)]
+    startedChunks = multiprocessing.SimpleQueue()
+    workerArgs = (laws, check_all, cachePath, infer, stats, limits, True, startedChunks)
+    pending = list(range(len(chunks)))
+    isolated = []
+    while pending != []:
+        broken = []
+        with ProcessPoolExecutor(jobs or os.cpu_count(), initializer=init_batch_worker, initargs=workerArgs) as executor:
+            futures = dict((executor.submit(check_batch_files, chunks[chunk], chunk), chunk) for chunk in pending)
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except BrokenProcessPool:
+                    broken.append(futures[future])
+                    continue
+                for verdict in results:
+                    emit(verdict)
+        started = set()
+        while not startedChunks.empty():
+            started.add(startedChunks.get())
+        suspects = [chunk for chunk in broken if chunk in started] or broken
+        isolated.extend(suspects)
+        pending = [chunk for chunk in broken if chunk not in suspects]
+    for path in (path for chunk in isolated for path in chunks[chunk]):
+        with ProcessPoolExecutor(1, initializer=init_batch_worker, initargs=workerArgs) as executor:
+            try:
+                [verdict] = executor.submit(check_batch_files, [path]).result()
+            except BrokenProcessPool:
+                verdict = {'file': path, 'status': 'crash', 'line': None, 'message': 'Worker process died', 'time': None}
+        emit(verdict)
+    return verdicts
+
+def check_server_outline(name, text, check_all):
+    """Checks an outline sent to the server with batchChecker and returns its verdict (see check_batch_file)."""
+    return get_batch_verdict(batchChecker, name, lambda: batchChecker.check_text(text, check_all), check_all)
+
+def warm_batch_worker():
+    return os.getpid()
+
+def get_percentile(sortedValues, p):
+    """Returns the p-th percentile of a non-empty sorted list by the nearest-rank method."""
+    return sortedValues[max(0, math.ceil(p / 100 * len(sortedValues)) - 1)]
+
+class CheckServer:
+    """
+    Checks outlines sent over HTTP in a pool of jobs warm worker processes, set up as for run_batch. At most capacity
+    outlines are queued or being checked at a time; a request that would exceed this is refused, so that clients back
+    off instead of piling up. A request that is not answered within timeout seconds gets a 'timeout' verdict for the
+    outlines not yet checked. The latencies of the last latencyWindow accepted requests are kept for the metrics.
+    """
+    latencyWindow = 1000
+    maxBodySize = 16 * 1024 * 1024
+
+    def __init__(self, laws=None, jobs=None, queueSize=None, timeout=60, check_all=False, cachePath=None, infer=False, limits=None):
+        self.jobs = jobs or os.cpu_count()
+        self.capacity = self.jobs + (16 * self.jobs if queueSize is None else queueSize)
+        self.timeout = timeout
+        self.check_all = check_all
+        # A check that timed out must not keep its worker busy; without a time limit per file, the timeout is one
+        if limits is None or limits.fileTime is None:
+            limits = Limits(**dict((name, getattr(limits, name, None)) for name in Limits.names))
+            limits.fileTime = timeout
+        # The outlines come from clients, which must not get the server to read its files as law libraries
+        self.workerArgs = (laws, check_all, cachePath, infer, False, limits, False)
+        self.lock = threading.Lock()
+        self.inFlight = 0
+        self.startTime = time.time()
+        self.latencies = collections.deque(maxlen=self.latencyWindow)
+        self.counts = collections.Counter()
+        self.executor = self.start_pool()
+        # Wait until each worker has loaded the laws
+        for future in [self.executor.submit(warm_batch_worker) for _ in range(self.jobs)]:
+            future.result()
+
+    def start_pool(self):
+        return ProcessPoolExecutor(self.jobs, initializer=init_batch_worker, initargs=self.workerArgs)
+
+    def restart_pool(self, executor):
+        """Replaces executor, whose worker died, by a new pool, unless another request replaced it already."""
+        with self.lock:
+            if self.executor is executor:
+                self.executor = self.start_pool()
+                self.counts['poolRestarts'] += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def release(self, future):
+        with self.lock:
+            self.inFlight -= 1
+
+    def check_outlines(self, outlines, check_all):
+        """
+        Checks a list of (name, text) pairs and returns their verdicts, in order, or None if the queue has no room for
+        them.
+        """
+        deadline = time.perf_counter() + self.timeout
+        with self.lock:
+            if self.inFlight + len(outlines) > self.capacity:
+                return None
+            self.inFlight += len(outlines)
+            executor = self.executor
+        futures = []
+        for name, text in outlines:
+            future = None
+            for attempt in range(2):
+                try:
+                    future = executor.submit(check_server_outline, name, text, check_all)
+                    break
+                except BrokenProcessPool:
+                    # A worker died before this request came in; try again in a new pool
+                    self.restart_pool(executor)
+                    executor = self.executor
+            if future is None:
+                self.release(None)
+            else:
+                future.add_done_callback(self.release)
+            futures.append(future)
+        verdicts = []
+        for (name, text), future in zip(outlines, futures):
+            try:
+                if future is None:
+                    raise BrokenProcessPool()
+                verdict = future.result(max(0, deadline - time.perf_counter()))
+            except FutureTimeoutError:
+                future.cancel()
+                verdict = {'file': name, 'status': 'timeout', 'line': None, 'message': 'Time limit exceeded (%s s)' % self.timeout, 'time': None}
+            except BrokenProcessPool:
+                self.restart_pool(executor)
+                verdict = {'file': name, 'status': 'crash', 'line': None, 'message': 'Worker process died', 'time': None}
+            verdicts.append(verdict)
+        return verdicts
+
+    def record(self, latency, verdicts):
+        with self.lock:
+            self.counts['requests'] += 1
+            if verdicts is None:
+                self.counts['rejected'] += 1
+            else:
+                self.latencies.append(latency)
+                for verdict in verdicts:
+                    self.counts[verdict['status']] += 1
+
+    def get_metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = {
+                'uptime': time.time() - self.startTime,
+                'jobs': self.jobs,
+                'capacity': self.capacity,
+                'inFlight': self.inFlight,
+                'queueDepth': max(0, self.inFlight - self.jobs),
+                'counts': dict(self.counts)
+            }
+        metrics['latency'] = None if latencies == [] else dict(
+            [('p%d' % p, get_percentile(latencies, p)) for p in (50, 90, 99)] + [('max', latencies[-1]), ('samples', len(latencies))])
+        return metrics
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class CheckRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    The HTTP interface of a CheckServer: POST /check checks one outline, sent either as JSON {"text": ..., "name": ...,
+    "all": ...} or as the raw text of the outline (with ?all=1 for all errors), and answers its verdict; POST
+    /check-batch checks the outlines of JSON {"outlines": [{"text": ..., "name": ...}, ...], "all": ...} and answers
+    {"verdicts": [...]}; GET /metrics answers the server's metrics. All answers are JSON.
+    """
+    def send_json(self, status, value, headers=()):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, headerValue in headers:
+            self.send_header(name, headerValue)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=()):
+        self.send_json(status, {'error': message}, headers)
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == '/metrics':
+            self.send_json(200, self.server.checkServer.get_metrics())
+        else:
+            self.send_error_json(404, "No such resource: %s" % self.path)
+
+    def read_request(self, path, query, length):
+        """Returns the check_all flag and the (name, text) pairs of a request; raises ValueError if it is malformed."""
+        body = self.rfile.read(length).decode()
+        checkServer = self.server.checkServer
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            if path != '/check':
+                raise ValueError("%s requires a JSON body" % path)
+            return query.get('all', ['0'])[0] not in ('', '0', 'false'), [('<request>', body)]
+        request = json.loads(body)
+        if not isinstance(request, dict):
+            raise ValueError("The body must be a JSON object")
+        outlines = [request] if path == '/check' else request.get('outlines')
+        if not isinstance(outlines, list) or not all(isinstance(outline, dict) and isinstance(outline.get('text'), str) for outline in outlines):
+            raise ValueError("Each outline must be a JSON object with a text")
+        return bool(request.get('all', checkServer.check_all)), [(str(outline.get('name', '<request>')), outline['text']) for outline in outlines]
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        if url.path not in ('/check', '/check-batch'):
+            self.send_error_json(404, "No such resource: %s" % self.path)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError("Invalid Content-Length: %d" % length)
+            if length > CheckServer.maxBodySize:
+                self.send_error_json(413, "A request can have at most %d bytes" % CheckServer.maxBodySize)
+                return
+            check_all, outlines = self.read_request(url.path, urllib.parse.parse_qs(url.query, keep_blank_values=True), length)
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+        checkServer = self.server.checkServer
+        if len(outlines) > checkServer.capacity:
+            self.send_error_json(413, "A batch can have at most %d outlines" % checkServer.capacity)
+            return
+        verdicts = checkServer.check_outlines(outlines, check_all)
+        checkServer.record(time.perf_counter() - start, verdicts)
+        if verdicts is None:
+            self.send_error_json(503, "Too many outlines waiting to be checked; try again later", [('Retry-After', '1')])
+        elif url.path == '/check':
+            self.send_json(504 if verdicts[0]['status'] == 'timeout' else 200, verdicts[0])
+        else:
+            self.send_json(200, {'verdicts': verdicts})
+
+def run_server(address, laws=None, jobs=None, queueSize=None, timeout=60, check_all=False, cachePath=None, infer=False, limits=None):
+    """
+    Serves CheckRequestHandler at address, a (host, port) pair, until interrupted, with a CheckServer set up with the
+    other arguments. Returns the exit status.
+    """
+    checkServer = CheckServer(laws, jobs, queueSize, timeout, check_all, cachePath, infer, limits)
+    httpServer = http.server.ThreadingHTTPServer(address, CheckRequestHandler)
+    httpServer.daemon_threads = True
+    httpServer.checkServer = checkServer
+    host, port = httpServer.server_address[:2]
+    print("Listening on http://%s:%d with %d workers" % (host, port, checkServer.jobs), flush=True)
+    try:
+        httpServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpServer.server_close()
+        checkServer.close()
+    return 0
+
+class BackgroundChecker:
+    """
+    Checks outlines with an IncrementalChecker on a worker thread. submit replaces the text waiting to be checked, if
+    any, and cancels the check in progress. For each completed check, a (text, result) pair is put on the results
+    queue, where result is a CheckResult with all errors or, if checking crashed, the exception.
+    """
+    def __init__(self, laws=None):
+        self.checker = IncrementalChecker(laws)
+        self.checker.cancelled = lambda: self.pendingText is not None
+        self.pendingText = None
+        self.condition = threading.Condition()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, text):
+        with self.condition:
+            self.pendingText = text
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pendingText is None:
+                    self.condition.wait()
+                text = self.pendingText
+                self.pendingText = None
+            try:
+                result = self.checker.check_text(text, check_all=True)
+            except CheckCancelled:
+                continue
+            except Exception as e:
+                result = e
+            self.results.put((text, result))
+
+def read_lsp_message(stream):
+    """Reads a JSON-RPC message, preceded by its Content-Length header, from a binary stream, or None at the end."""
+    length = None
+    while True:
+        header = stream.readline()
+        if header == b'':
+            return None
+        header = header.strip()
+        if header != b'':
+            name, _, value = header.partition(b':')
+            if name.strip().lower() == b'content-length':
+                length = int(value)
+        elif length is not None:
+            body = stream.read(length)
+            if len(body) < length:
+                return None
+            return json.loads(body.decode('utf-8'))
+
+def write_lsp_message(stream, message):
+    body = json.dumps(message).encode('utf-8')
+    stream.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+    stream.flush()
+
+def get_line_length(lineText):
+    return len(lineText) - lineText.endswith('\n')
+
+def get_column_index(lineText, character, utf16):
+    """
+    Returns the index in lineText of an LSP position's character offset, counted in UTF-16 code units if utf16 is set
+    and in code points otherwise. Offsets beyond the end of the line denote the end of the line.
+    """
+    length = get_line_length(lineText)
+    if not utf16 or lineText.isascii():
+        return min(character, length)
+    index = 0
+    while index < length and character > 0:
+        character -= 2 if ord(lineText[index]) > 0xFFFF else 1
+        index += 1
+    return index
+
+def get_lsp_character(lineText, index, utf16):
+    """Returns the LSP character offset of the given index in lineText; see get_column_index."""
+    if not utf16 or lineText.isascii():
+        return index
+    return len(lineText[:index].encode('utf-16-le')) // 2
+
+class LspDocument:
+    """
+    An open document of a LanguageServer, kept as a list of lines (see split_lines). An incremental change replaces
+    only the lines it touches.
+    """
+    def __init__(self, text, version):
+        self.lines = split_lines(text)
+        self.version = version
+
+    def get_text(self):
+        return ''.join(self.lines)
+
+    def get_line(self, lineNo):
+        return self.lines[lineNo] if 0 <= lineNo < len(self.lines) else ''
+
+    def apply_change(self, change, utf16):
+        if 'range' not in change:
+            self.lines = split_lines(change['text'])
+            return
+        start, end = change['range']['start'], change['range']['end']
+        startLine = self.get_line(start['line'])
+        endLine = self.get_line(end['line'])
+        prefix = startLine[:get_column_index(startLine, start['character'], utf16)]
+        suffix = endLine[get_column_index(endLine, end['character'], utf16):]
+        self.lines[start['line']:end['line'] + 1] = split_lines(prefix + change['text'] + suffix)
+
+    def get_position(self, lineNo, col, utf16):
+        """Returns the LSP position of a location of a LocError; column -1 denotes the end of the line."""
+        lineText = self.get_line(lineNo)
+        index = get_line_length(lineText) if col == -1 else min(col, get_line_length(lineText))
+        return {'line': lineNo, 'character': get_lsp_character(lineText, index, utf16)}
+
+class LanguageServer:
+    """
+    A server for the Language Server Protocol, over a pair of binary streams, that checks the open documents with a
+    single IncrementalChecker, and so with a single law table, and publishes the errors as diagnostics. Documents are
+    synchronized incrementally. Messages are read on a separate thread; a check in progress is cancelled as soon as
+    a message comes in, and the documents that changed are checked again once no more messages are waiting. Since
+    the checker reuses the results for unchanged lines, blocks and steps, the time a check takes after an edit
+    depends mostly on the steps that the edit touched.
+    """
+    def __init__(self, input, output, laws=None, infer=False, limits=None):
+        self.input = input
+        self.output = output
+        self.messages = queue.Queue()
+        self.checker = IncrementalChecker(laws, infer=infer, limits=limits)
+        self.checker.cancelled = lambda: not self.messages.empty()
+        self.documents = {}
+        self.outdated = {}
+        self.utf16 = True
+        self.shutdownRequested = False
+
+    def read_messages(self):
+        while True:
+            message = read_lsp_message(self.input)
+            self.messages.put(message)
+            if message is None:
+                return
+
+    def send(self, message):
+        message['jsonrpc'] = '2.0'
+        write_lsp_message(self.output, message)
+
+    def run(self):
+        """Serves until the exit notification or the end of the input. Returns the exit status."""
+        threading.Thread(target=self.read_messages, daemon=True).start()
+        while True:
+            if self.outdated and self.messages.empty():
+                self.check_document(next(iter(self.outdated)))
+                continue
+            message = self.messages.get()
+            if message is None:
+                return 1
+            if message.get('method') == 'exit':
+                return 0 if self.shutdownRequested else 1
+            try:
+                self.handle(message)
+            except Exception as e:
+                if 'id' in message and 'method' in message:
+                    self.send({'id': message['id'], 'error': {'code': -32603, 'message': '%s: %s' % (type(e).__name__, e)}})
+
+    def handle(self, message):
+        method = message.get('method')
+        params = message.get('params') or {}
+        if method == 'initialize':
+            encodings = params.get('capabilities', {}).get('general', {}).get('positionEncodings', [])
+            self.utf16 = 'utf-32' not in encodings
+            self.send({'id': message['id'], 'result': {
+                'capabilities': {'positionEncoding': 'utf-16' if self.utf16 else 'utf-32', 'textDocumentSync': {'openClose': True, 'change': 2}},
+                'serverInfo': {'name': 'proofchecker'}}})
+        elif method == 'shutdown':
+            self.shutdownRequested = True
+            self.send({'id': message['id'], 'result': None})
+        elif method == 'textDocument/didOpen':
+            textDocument = params['textDocument']
+            self.documents[textDocument['uri']] = LspDocument(textDocument['text'], textDocument.get('version'))
+            self.outdated[textDocument['uri']] = None
+        elif method == 'textDocument/didChange':
+            uri = params['textDocument']['uri']
+            document = self.documents[uri]
+            for change in params['contentChanges']:
+                document.apply_change(change, self.utf16)
+            document.version = params['textDocument'].get('version')
+            self.outdated[uri] = None
+        elif method == 'textDocument/didClose':
+            uri = params['textDocument']['uri']
+            self.documents.pop(uri, None)
+            self.outdated.pop(uri, None)
+            self.checker.close_document(uri)
+            self.send({'method': 'textDocument/publishDiagnostics', 'params': {'uri': uri, 'diagnostics': []}})
+        elif method is not None and 'id' in message:
+            self.send({'id': message['id'], 'error': {'code': -32601, 'message': "Method not found: %s" % method}})
+
+    def check_document(self, uri):
+        document = self.documents[uri]
+        uriParts = urllib.parse.urlparse(uri)
+        # Law libraries are looked up relative to the directory of the document
+        self.checker.baseDir = os.path.dirname(urllib.parse.unquote(uriParts.path)) if uriParts.scheme == 'file' else None
+        try:
+            result = self.checker.check_text(document.get_text(), check_all=True, document=uri)
+        except CheckCancelled:
+            return
+        except Exception as e:
+            result = e
+        del self.outdated[uri]
+        self.send({'method': 'textDocument/publishDiagnostics', 'params': {'uri': uri, 'version': document.version, 'diagnostics': self.get_diagnostics(document, result)}})
+
+    def get_diagnostics(self, document, result):
+        """Returns the diagnostics for a CheckResult or, if checking crashed, the exception."""
+        def diagnostic(startLine, startCol, endLine, endCol, severity, message):
+            start = document.get_position(startLine, startCol, self.utf16)
+            end = document.get_position(endLine, endCol, self.utf16)
+            if (end['line'], end['character']) < (start['line'], start['character']):
+                end = start
+            return {'range': {'start': start, 'end': end}, 'severity': severity, 'source': 'proofchecker', 'message': message}
+
+        if isinstance(result, Exception):
+            return [diagnostic(0, 0, 0, -1, 1, "%s: %s" % (type(result).__name__, result))]
+        diagnostics = []
+        for error in result.errors:
+            (startLine, startCol), (endLine, endCol) = error.loc
+            if startCol < 0:
+                # An error at a line break; the lexer counts the break to the next line
+                startLine = endLine = max(0, startLine - 1)
+                startCol = endCol = -1
+            diagnostics.append(diagnostic(startLine, startCol, endLine, endCol, 2 if isinstance(error, ResourceLimitExceeded) else 1, error.message))
+        for step in result.steps:
+            if step.justification is not None:
+                diagnostics.append(diagnostic(step.line, 0, step.line, -1, 3, "# %s" % step.justification))
+        return diagnostics
+
+def run_lsp(laws=None, infer=False, limits=None):
+    """Runs a LanguageServer on the standard input and output, and exits the process when it stops."""
+    server = LanguageServer(sys.stdin.buffer, sys.stdout.buffer, laws, infer=infer, limits=limits)
+    status = server.run()
+    # The reader thread may still be blocked on the standard input, which makes a normal interpreter shutdown abort
+    sys.stdout.flush()
+    os._exit(status)
+
+def run_gui(path='gevolgtrekkingen_uit_voorbeeldsilhouetten.py', debounceMillis=300):
+    import tkinter
+    from tkinter import scrolledtext, messagebox
+
     window = tkinter.Tk()
     window.title("Proof Checker")
     panedWindow = tkinter.PanedWindow(window, orient=tkinter.VERTICAL)
+    backgroundChecker = BackgroundChecker()
+    checkWhileTyping = tkinter.BooleanVar(value=True)
+    pendingCheck = None
+
+    def highlight_error(e):
+        (startLine, startCol), (endLine, endCol) = e.loc
+        text_box.tag_add('error', '%d.%s' % (startLine + 1, 'end' if startCol == -1 else startCol), '%d.%s' % (endLine + 1, 'end' if endCol == -1 else endCol))
 
     def check_proof():
         text_box.tag_remove('error', '1.0', tkinter.END)
@@ -762,13 +3698,47 @@ else:
             check_text(text_box.get('1.0', tkinter.END))
             messagebox.showinfo(message="Geen fouten gevonden; het bewijs is geldig!")
         except LocError as e:
-            (startLine, startCol), (endLine, endCol) = e.loc
             print(e.loc)
-            text_box.tag_add('error', '%d.%s' % (startLine + 1, 'end' if startCol == -1 else startCol), '%d.%s' % (endLine + 1, 'end' if endCol == -1 else endCol))
-            error_msg_box.insert('1.0', e.args[0])
+            highlight_error(e)
+            error_msg_box.insert('1.0', e.message)
+
+    def submit_text():
+        nonlocal pendingCheck
+        pendingCheck = None
+        backgroundChecker.submit(text_box.get('1.0', tkinter.END))
+
+    def on_modified(event):
+        nonlocal pendingCheck
+        text_box.edit_modified(False)
+        if not checkWhileTyping.get():
+            return
+        if pendingCheck is not None:
+            window.after_cancel(pendingCheck)
+        pendingCheck = window.after(debounceMillis, submit_text)
+
+    def show_background_results():
+        latest = None
+        while not backgroundChecker.results.empty():
+            latest = backgroundChecker.results.get()
+        # Results for a text that has been edited since are outdated
+        if latest is not None and checkWhileTyping.get() and latest[0] == text_box.get('1.0', tkinter.END):
+            text, result = latest
+            text_box.tag_remove('error', '1.0', tkinter.END)
+            error_msg_box.delete('1.0', tkinter.END)
+            if isinstance(result, Exception):
+                error_msg_box.insert('1.0', "%s: %s" % (type(result).__name__, result))
+            elif result.is_valid():
+                error_msg_box.insert('1.0', "Geen fouten gevonden; het bewijs is geldig!")
+            else:
+                for e in result.errors:
+                    highlight_error(e)
+                error_msg_box.insert('1.0', '\n'.join(str(e) for e in result.errors))
+        window.after(50, show_background_results)
+
     menubar = tkinter.Menu(window)
     proof = tkinter.Menu(menubar)
     proof.add_command(label="Check proof", command=check_proof)
+    proof.add_checkbutton(label="Check while typing", variable=checkWhileTyping, command=submit_text)
     menubar.add_cascade(label="Proof", menu=proof)
 
     # display the menu
@@ -776,11 +3746,12 @@ else:
 
     text_box = scrolledtext.ScrolledText(panedWindow)
     text_box.pack(fill=tkinter.BOTH, expand=True)
-    with open('gevolgtrekkingen_uit_voorbeeldsilhouetten.py') as f:
+    with open(path) as f:
         text = f.read()
     text_box.insert('1.0', text)
 
     text_box.tag_config('error', foreground='red', underline=1)
+    text_box.bind('<<Modified>>', on_modified)
     panedWindow.add(text_box)
 
     error_msg_box = scrolledtext.ScrolledText(panedWindow)
@@ -789,4 +3760,130 @@ else:
 
     panedWindow.pack(fill=tkinter.BOTH, expand=True)
 
+    window.after(50, show_background_results)
     tkinter.mainloop()
+
+def format_stats(stats):
+    return "%.3f ms%s" % (stats['time'] * 1000, ''.join(', %s=%d' % (name, stats[name]) for name in statNames if stats[name]))
+
+def print_stats(result):
+    for stats in sorted(result.stats, key=lambda stats: stats['time'], reverse=True):
+        print("line %d: %s" % (stats['line'], format_stats(stats)))
+    totals = result.get_stats_totals()
+    print("%d steps: %s" % (totals['steps'], format_stats(totals)))
+    for name, info in get_cache_info().items():
+        print("cache %s: %d/%d entries, %d hits, %d misses" % (name, info['size'], info['maxsize'], info['hits'], info['misses']))
+
+def run_stream(path, laws=None, check_all=False, infer=False, stats=False, limits=None):
+    """Checks the outline at path with Checker.check_lines, printing results as they come. Returns the exit status."""
+    checker = Checker(laws, infer=infer, stats=stats, limits=limits)
+    checker.baseDir = os.path.dirname(path)
+    if stats:
+        checker.statsCallback = lambda stats: print("line %d: %s" % (stats['line'], format_stats(stats)))
+    valid = True
+    try:
+        with open(path) as f:
+            for kind, lineNo, item in checker.check_lines(f, check_all):
+                if kind == 'error':
+                    print(item)
+                    valid = False
+                elif kind == 'step':
+                    if item.justification is not None:
+                        print("%d: # %s" % (lineNo + 1, item.justification))
+                    if item.error is not None:
+                        print(item.error)
+                        valid = False
+    except LocError as e:
+        print(e)
+        return 1
+    if valid:
+        print("%s was checked successfully; the proof outline is valid!" % (path,))
+        return 0
+    return 1
+
+def main(args):
+    argParser = argparse.ArgumentParser(description="Checks proof outlines. Without arguments, opens the editor.")
+    argParser.add_argument('paths', nargs='*', help="the proof outline to check; with --batch, files and directories")
+    argParser.add_argument('--laws', help="a law library, i.e. a file of law declarations or its compiled form, visible in every outline")
+    argParser.add_argument('--compile-laws', action='store_true', help="compile the given file of law declarations into a law library that loads faster (see --output)")
+    argParser.add_argument('--all', action='store_true', help="report all errors instead of only the first one")
+    argParser.add_argument('--batch', action='store_true', help="check all given outlines in parallel; print JSON lines")
+    argParser.add_argument('--jobs', type=int, help="number of worker processes for --batch and --serve (default: one per core) or, for a single outline, for checking the steps of each long proof in parallel")
+    argParser.add_argument('--chunk-size', type=int, default=8, help="number of files per worker task for --batch")
+    argParser.add_argument('--infer', action='store_true', help="search a justification for each step without one")
+    argParser.add_argument('--stats', action='store_true', help="report the time taken and the work done per step")
+    argParser.add_argument('--limits', type=Limits.parse, help="resource limits per step and per file, e.g. stepTime=1,fileTime=10,matchSteps=100000 (names: %s)" % ', '.join(Limits.names))
+    argParser.add_argument('--lsp', action='store_true', help="run a language server on the standard input and output")
+    argParser.add_argument('--serve', metavar='[HOST:]PORT', help="serve POST /check, POST /check-batch and GET /metrics over HTTP at the given address (host default: localhost)")
+    argParser.add_argument('--timeout', type=float, default=60, help="time limit in seconds per --serve request (default: 60)")
+    argParser.add_argument('--queue-size', type=int, help="number of outlines --serve lets wait for a worker before refusing requests (default: 16 per worker)")
+    argParser.add_argument('--stream', action='store_true', help="check the outline line by line, printing each error as soon as it is found")
+    argParser.add_argument('--cache-size', type=int, help="maximum number of entries of each in-memory cache of normal forms, law instances and step verdicts (default: 4096)")
+    argParser.add_argument('--cache', help="a database file in which to keep the results for proof blocks across runs")
+    argParser.add_argument('--output', help="file to write the JSON lines of --batch to (default: standard output), or the law library of --compile-laws to (default: the file's name with extension .laws)")
+    options = argParser.parse_args(args[1:])
+
+    if options.cache_size is not None:
+        set_cache_size(options.cache_size)
+    laws = None
+    try:
+        if options.laws is not None:
+            laws = load_law_library(options.laws)
+        if options.compile_laws:
+            if len(options.paths) != 1:
+                argParser.error("--compile-laws requires one law library")
+            laws = load_law_library(options.paths[0])
+    except LawLibraryError as e:
+        print(e)
+        return 1
+
+    if options.compile_laws:
+        outputPath = options.output or os.path.splitext(options.paths[0])[0] + '.laws'
+        with open(outputPath, 'wb') as f:
+            f.write(compile_law_library(laws))
+        print("%d laws compiled to %s" % (len(laws), outputPath))
+        return 0
+    elif options.batch:
+        output = sys.stdout if options.output is None else open(options.output, 'w')
+        try:
+            verdicts = run_batch(options.paths, output, laws, options.jobs, options.chunk_size, options.all, options.cache, options.infer, options.stats, options.limits)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        return 0 if all(verdict['status'] == 'valid' for verdict in verdicts) else 1
+    elif options.lsp:
+        return run_lsp(laws, options.infer, options.limits)
+    elif options.serve is not None:
+        host, _, port = options.serve.rpartition(':')
+        return run_server((host or 'localhost', int(port)), laws, options.jobs, options.queue_size, options.timeout, options.all, options.cache, options.infer, options.limits)
+    elif len(options.paths) == 1 and options.stream:
+        return run_stream(options.paths[0], laws, options.all, options.infer, options.stats, options.limits)
+    elif len(options.paths) == 1:
+        path = options.paths[0]
+        checker = Checker(laws, cache=None if options.cache is None else ResultCache(options.cache), infer=options.infer, stats=options.stats, limits=options.limits, jobs=options.jobs)
+        try:
+            result = checker.check_file(path, options.all)
+        except LocError as e:
+            print(e)
+            return 1
+        finally:
+            checker.close()
+        for step in result.steps:
+            if step.justification is not None:
+                print("%d: # %s" % (step.line + 1, step.justification))
+        if result.stats is not None:
+            print_stats(result)
+        if result.is_valid():
+            print("%s was checked successfully; the proof outline is valid!" % (path,))
+            return 0
+        for error in result.errors:
+            print(error)
+        return 1
+    elif options.paths == []:
+        run_gui()
+        return 0
+    else:
+        argParser.error("checking several outlines requires --batch")
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,177 @@
+import http.client
+import http.server
+import io
+import json
+import os
+import threading
+
+import proofchecker
+
+from proofchecker import Checker, CheckRequestHandler, CheckServer, LanguageServer, LawLibraryError, LawTable, Limits, LspDocument, Parser, ProofError, ResourceLimitExceeded, ResultCache, add_law, compile_law_library, decode_law_library, get_conjuncts, infer_justification, main, parse_law_library, run_batch, set_cache_size
+
+def test_missing_law_library_is_reported_at_its_line(tmp_path):
+    checker = Checker()
+    checker.baseDir = str(tmp_path)
+    result = checker.check_text("assert x == 0\n# Wetten: ontbrekend.laws\n")
+    [error] = result.errors
+    assert type(error) is ProofError
+    assert error.loc == ((1, 0), (1, -1))
+    assert os.path.join(str(tmp_path), 'ontbrekend.laws') in error.message
+
+def test_inference_budget_bounds_forward_facts():
+    laws = LawTable()
+    add_law(laws, *Parser("# Wet T: x <= y and y <= z and z <= w and w <= v ==> x <= v\n").parseLaw())
+    antecedent = get_conjuncts(Parser(' and '.join('a%d <= b%d' % (i, i) for i in range(40))).parseExpression())
+    # The law applies in 40 ** 4 ways; only budget candidates may be enumerated
+    assert infer_justification(laws, antecedent, [Parser('q == 1').parseExpression()], budget=200) is None
+
+def test_server_rejects_law_libraries_and_malformed_lengths(tmp_path):
+    library = tmp_path / 'wetten.txt'
+    library.write_text("# Wet T: x == y ==> y == x\n")
+    httpServer = http.server.ThreadingHTTPServer(('localhost', 0), CheckRequestHandler)
+    httpServer.checkServer = CheckServer(jobs=1)
+    threading.Thread(target=httpServer.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*httpServer.server_address[:2])
+        connection.request('POST', '/check', "# Wetten: %s\n" % library)
+        verdict = json.loads(connection.getresponse().read())
+        assert verdict['status'] == 'invalid' and verdict['line'] == 1
+        connection.putrequest('POST', '/check')
+        connection.putheader('Content-Length', 'veel')
+        connection.endheaders()
+        assert connection.getresponse().status == 400
+    finally:
+        httpServer.shutdown()
+        httpServer.server_close()
+        httpServer.checkServer.close()
+
+def test_intern_tables_stay_bounded_across_checks(monkeypatch):
+    monkeypatch.setattr(Checker, 'maxInternedTerms', 1000)
+    checker = Checker()
+    for i in range(500):
+        assert checker.check_text("assert x%d == %d\nassert %d == x%d # Z op 1\n" % (i, i, i, i)).is_valid()
+    assert len(proofchecker.termTable) <= 1000
+    assert proofchecker.get_monomial_table_size() <= 1000
+
+def test_rewriting_is_modulo_associativity_and_commutativity():
+    checker = Checker()
+    assert checker.check_text("assert x == y and a + (b + x) == 0\nassert (a + b) + y == 0 # Herschrijven met 1 in 2\n").is_valid()
+    assert not checker.check_text("assert x == y and a + (b + x) == 0\nassert (a + c) + y == 0 # Herschrijven met 1 in 2\n").is_valid()
+
+def is_valid_outline(text):
+    return Checker().check_text(text).is_valid()
+
+def test_rewriting_does_not_replace_other_subterms():
+    assert not is_valid_outline("assert i == n and i <= 5\nassert 7 <= 5 # Herschrijven met 1 in 2\n")
+
+def test_z_on_integer_constraints():
+    assert is_valid_outline("assert 2 * i <= 3\nassert i <= 1 # Z op 1\n")
+    assert not is_valid_outline("assert 2 * i <= 3\nassert i <= 0 # Z op 1\n")
+    # 2 * i == 3 has no solution in Z, and 2 * i != 3 always holds
+    assert is_valid_outline("assert 2 * i == 3\nassert 1 == 0 # Z op 1\n")
+    assert is_valid_outline("assert i <= n\nassert 2 * i != 3 # Z op 1\n")
+    assert is_valid_outline("assert a + b == c\nassert c == b + a # Z op 1\n")
+    assert is_valid_outline("assert i == 0\nassert i == 0 and i * (n + 1) == i * n + i # Z\n")
+
+def test_example_outline_is_valid():
+    path = os.path.join(os.path.dirname(__file__), 'gevolgtrekkingen_uit_voorbeeldsilhouetten.py')
+    assert main(['proofchecker.py', path]) == 0
+
+def test_batch_isolates_only_the_chunks_of_a_dead_worker(tmp_path, monkeypatch):
+    for i in range(12):
+        (tmp_path / ('%02d.py' % i)).write_text("assert x == 0\nassert 0 == x # Z op 1\n")
+    (tmp_path / '05.py').write_text("# crash\n")
+    checkFile = Checker.check_file
+
+    def check_file(self, path, check_all=False):
+        if path.endswith('05.py'):
+            os._exit(1)
+        return checkFile(self, path, check_all)
+
+    # The workers are forked, so they inherit the patched method
+    monkeypatch.setattr(Checker, 'check_file', check_file)
+    verdicts = run_batch([str(tmp_path)], io.StringIO(), jobs=2, chunkSize=2)
+    statuses = dict((os.path.basename(verdict['file']), verdict['status']) for verdict in verdicts)
+    assert len(statuses) == 12
+    assert statuses.pop('05.py') == 'crash'
+    assert set(statuses.values()) == {'valid'}
+
+def test_rewriting_descends_into_operands():
+    assert is_valid_outline("assert n == i + 1 and s + (i + 1) <= n\nassert s + n <= n # Herschrijven met 1 in 2\n")
+    assert is_valid_outline("assert y * z == w and x * (y * z) == 0\nassert x * w == 0 # Herschrijven met 1 in 2\n")
+    assert is_valid_outline("# Wet Dubbel: X + X == 2 * X\n\nassert a + a + b == 0\nassert 2 * a + b == 0 # Herschrijven met Dubbel in 1\n")
+    assert is_valid_outline("# Wet F: f(X) == X\n\nassert f(f(c)) + f(c) == 0\nassert f(c) + c == 0 # Herschrijven met F in 1\n")
+
+def test_lsp_reports_a_parse_error_at_a_line_break_on_its_line():
+    text = "assert x == \nassert y == 1\n"
+    server = LanguageServer(io.BytesIO(), io.BytesIO())
+    document = LspDocument(text, 1)
+    [diagnostic] = server.get_diagnostics(document, server.checker.check_text(text, check_all=True))
+    assert diagnostic['range'] == {'start': {'line': 0, 'character': 12}, 'end': {'line': 0, 'character': 12}}
+
+def test_cache_size_option_bounds_the_caches(capsys):
+    path = os.path.join(os.path.dirname(__file__), 'gevolgtrekkingen_uit_voorbeeldsilhouetten.py')
+    try:
+        assert main(['proofchecker.py', '--stats', '--cache-size', '2', path]) == 0
+    finally:
+        set_cache_size(4096)
+    assert "cache poly: 2/2 entries" in capsys.readouterr().out
+
+lawOutline = "# Wet Sym: X == Y ==> Y == X\n\nassert a == b\nassert b == a # Sym op 1\nassert a == b # Sym op 1\n"
+
+def test_result_cache_reuses_results_across_runs(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = ResultCache(path)
+    first = Checker(cache=cache).check_text(lawOutline)
+    cache.close()
+    cache = ResultCache(path)
+    second = Checker(cache=cache).check_text(lawOutline)
+    cache.close()
+    assert first.is_valid() and second.is_valid()
+    assert cache.hits > 0 and cache.misses == 0
+    assert [step.to_dict() for step in second.steps] == [step.to_dict() for step in first.steps]
+
+def test_exceeding_a_limit_gives_the_step_a_limit_verdict():
+    result = Checker(limits=Limits(termSize=2)).check_text(lawOutline)
+    assert [step.status for step in result.steps] == ['limit', 'limit']
+    assert all(type(error) is ResourceLimitExceeded for error in result.errors)
+    assert result.errors[0].loc[0] == (3, 0)
+
+def test_batch_reports_the_limit_status(tmp_path):
+    (tmp_path / 'wet.py').write_text(lawOutline)
+    output = io.StringIO()
+    [verdict] = run_batch([str(tmp_path)], output, jobs=1, limits=Limits(termSize=2))
+    assert verdict['status'] == 'limit' and verdict['line'] == 4
+    assert json.loads(output.getvalue()) == verdict
+
+def test_stream_prints_errors_as_they_are_found(tmp_path, capsys):
+    path = tmp_path / 'fout.py'
+    path.write_text("assert x == 0\nassert x == 1 # Z op 1\n")
+    assert main(['proofchecker.py', '--stream', str(path)]) == 1
+    assert capsys.readouterr().out.startswith("2:0: ")
+
+def test_lsp_publishes_diagnostics_for_an_opened_document():
+    output = io.BytesIO()
+    server = LanguageServer(io.BytesIO(), output)
+    uri = 'untitled:oefening'
+    server.handle({'method': 'textDocument/didOpen', 'params': {'textDocument': {'uri': uri, 'version': 3, 'text': "assert x == 0\nassert x == 1 # Z op 1\n"}}})
+    server.check_document(uri)
+    message = proofchecker.read_lsp_message(io.BytesIO(output.getvalue()))
+    assert message['method'] == 'textDocument/publishDiagnostics'
+    assert message['params']['version'] == 3
+    [diagnostic] = message['params']['diagnostics']
+    assert diagnostic['range']['start'] == {'line': 1, 'character': 0} and diagnostic['severity'] == 1
+
+def test_compiled_law_library_round_trips(tmp_path):
+    laws = parse_law_library("# Wet Sym: X == Y ==> Y == X\n# Wet Trans: X == Y and Y == W ==> X == W\n")
+    data = compile_law_library(laws)
+    assert dict(decode_law_library(data)) == dict(laws)
+    try:
+        decode_law_library(data[:-1] + bytes([data[-1] ^ 1]))
+        assert False, "a corrupt library must be rejected"
+    except LawLibraryError:
+        pass
+    (tmp_path / 'wetten.laws').write_bytes(data)
+    checker = Checker()
+    checker.baseDir = str(tmp_path)
+    assert checker.check_text("# Wetten: wetten.laws\nassert a == b\nassert b == a # Sym op 1\n").is_valid()